@@ -1,23 +1,39 @@
-from typing import Union, List, Set
+from typing import Union, List, Set, Tuple
 from fastapi import FastAPI
-import requests
+from contextlib import asynccontextmanager
+import httpx
 from bs4 import BeautifulSoup
 import os
 import random
-import pandas as pd
-from azure.cosmos import CosmosClient, PartitionKey
+from openpyxl import load_workbook
+import hashlib
+import math
+import base64
+import mmap
+import struct
+from functools import cached_property
+from azure.core import MatchConditions
+from azure.cosmos import PartitionKey, exceptions
+from azure.cosmos.aio import CosmosClient
+import zlib
 import uuid
 import redis
+from redis import asyncio as aioredis
 import json
-from pydantic import BaseModel
+from pydantic import BaseModel, conint
 from dotenv import load_dotenv
 import re
+import time
+import asyncio
+from collections import Counter
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI()
-
 # Cosmos DB settings
 settings = {
     'host': os.getenv('COSMOS_HOST'),
@@ -26,77 +42,780 @@ settings = {
     'container_id': os.getenv('COSMOS_CONTAINER'),
 }
 
-# Initialize Cosmos client
-client = CosmosClient(settings['host'], settings['master_key'])
-
-# Create database if it doesn't exist
-try:
-    database = client.create_database_if_not_exists(id=settings['database_id'])
-except Exception as e:
-    print(f"Error creating database: {str(e)}")
-    database = client.get_database_client(settings['database_id'])
-
-# Create container if it doesn't exist
-try:
-    container = database.create_container_if_not_exists(
-        id=settings['container_id'],
-        partition_key=PartitionKey(path="/id"),
-        offer_throughput=400
+# Shared connection pools, created in the lifespan hook
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '50'))
+HTTP_TIMEOUT_SECONDS = 60
+
+cosmos_client: Union[CosmosClient, None] = None
+container = None
+redis_client: Union[aioredis.Redis, None] = None
+http_client: Union[httpx.AsyncClient, None] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global cosmos_client, container, redis_client, http_client
+
+    # Initialize Cosmos client; database/container creation happens in the background
+    cosmos_client = CosmosClient(settings['host'], settings['master_key'])
+    container = cosmos_client.get_database_client(settings['database_id']).get_container_client(
+        settings['container_id']
     )
-except Exception as e:
-    print(f"Error creating container: {str(e)}")
-    container = database.get_container_client(settings['container_id'])
-
-# Initialize Redis client
-redis_client = redis.Redis(
-    host=os.getenv('REDIS_HOST'),
-    port=int(os.getenv('REDIS_PORT')),
-    username=os.getenv('REDIS_USERNAME'),
-    password=os.getenv('REDIS_PASSWORD'),
-    decode_responses=True
-)
-
-async def save_to_cosmosdb(medicine_prices: dict):
+
+    # Initialize Redis client
+    redis_client = aioredis.Redis(
+        host=os.getenv('REDIS_HOST'),
+        port=int(os.getenv('REDIS_PORT')),
+        username=os.getenv('REDIS_USERNAME'),
+        password=os.getenv('REDIS_PASSWORD'),
+        decode_responses=True,
+        max_connections=REDIS_MAX_CONNECTIONS
+    )
+
+    http_client = httpx.AsyncClient(timeout=HTTP_TIMEOUT_SECONDS, follow_redirects=True)
+
+    # Serve from the on-disk snapshot right away; Cosmos DB is reconciled lazily
     try:
-        # Delete existing documents only if they exist
-        query = "SELECT * FROM c"
-        items = list(container.query_items(query=query, enable_cross_partition_query=True))
-        
-        # Delete existing items if any
+        snapshot = await asyncio.to_thread(load_catalog_snapshot, CATALOG_SNAPSHOT_PATH)
+        if snapshot is not None:
+            set_catalog_index(snapshot)
+    except Exception as e:
+        print(f"Failed to load catalog snapshot: {str(e)}")
+
+    reconciler = asyncio.create_task(reconcile_catalog())
+    update_listener = asyncio.create_task(listen_for_catalog_updates())
+    version_poller = asyncio.create_task(poll_catalog_version())
+
+    yield
+
+    reconciler.cancel()
+    update_listener.cancel()
+    version_poller.cancel()
+    await http_client.aclose()
+    await redis_client.aclose()
+    await cosmos_client.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Catalog updates are broadcast to every replica over Redis pub/sub so they
+# swap in the new catalog without waiting for the refresh interval
+CATALOG_UPDATES_CHANNEL = 'catalog:updates'
+
+
+async def publish_catalog_update(version: int):
+    await redis_client.publish(CATALOG_UPDATES_CHANNEL, json.dumps({"version": version}))
+
+
+async def listen_for_catalog_updates():
+    """Reload the catalog when another replica reports a newer version."""
+    while True:
+        try:
+            pubsub = redis_client.pubsub()
+            await pubsub.subscribe(CATALOG_UPDATES_CHANNEL)
+            async for message in pubsub.listen():
+                if message['type'] != 'message':
+                    continue
+                version = json.loads(message['data'])['version']
+                if catalog_index is None or version > catalog_index.version:
+                    await get_catalog_index(force_check=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Catalog update listener error: {str(e)}")
+            await asyncio.sleep(5)
+
+
+# How often (seconds) a replica re-checks Cosmos for a newer catalog version
+CATALOG_REFRESH_SECONDS = int(os.getenv('CATALOG_REFRESH_SECONDS', '60'))
+
+# The catalog is stored as name-hashed chunk documents plus a version pointer
+CATALOG_POINTER_ID = 'catalog'
+CATALOG_CHUNKS = int(os.getenv('CATALOG_CHUNKS', '64'))
+COSMOS_WRITE_CONCURRENCY = 8
+
+
+# Longest character n-gram kept in the substring posting lists
+SEARCH_GRAM_SIZE = 3
+
+
+class NameSearchIndex:
+    """
+    Prefix and substring search over medicine names.
+
+    Names are kept upper-cased and sorted, so prefix hits are one bisect range.
+    Every 1..SEARCH_GRAM_SIZE character gram maps to the ids of the names that
+    contain it, so substring hits only verify the rarest gram's posting list.
+    """
+
+    def __init__(self, names):
+        entries = sorted((name.upper(), name) for name in names)
+        self.upper = [entry[0] for entry in entries]
+        self.names = [entry[1] for entry in entries]
+
+        # Relevance order: shorter names first, then alphabetical
+        by_rank = sorted(range(len(self.names)), key=lambda name_id: (len(self.names[name_id]), self.upper[name_id]))
+        self.ranks = array('I', [0]) * len(by_rank)
+        for rank, name_id in enumerate(by_rank):
+            self.ranks[name_id] = rank
+        self.by_rank = array('I', by_rank)
+
+        # Posting lists are built in rank order so the best hits come first
+        postings = {}
+        for name_id in by_rank:
+            upper = self.upper[name_id]
+            grams = set()
+            for size in range(1, SEARCH_GRAM_SIZE + 1):
+                for start in range(len(upper) - size + 1):
+                    grams.add(upper[start:start + size])
+            for gram in grams:
+                postings.setdefault(gram, []).append(name_id)
+        self.postings = {gram: array('I', ids) for gram, ids in postings.items()}
+
+    def _substring_candidates(self, search_term: str):
+        if len(search_term) <= SEARCH_GRAM_SIZE:
+            return self.postings.get(search_term, ())
+
+        # Every match contains all of the term's grams, so the rarest one bounds the work
+        grams = {
+            search_term[start:start + SEARCH_GRAM_SIZE]
+            for start in range(len(search_term) - SEARCH_GRAM_SIZE + 1)
+        }
+        rarest = min((self.postings.get(gram, ()) for gram in grams), key=len)
+        return (name_id for name_id in rarest if search_term in self.upper[name_id])
+
+    def search(self, search_term: str, limit: int) -> List[str]:
+        """Return up to `limit` names containing the upper-cased `search_term`, prefix hits first."""
+        if not search_term:
+            return [self.names[name_id] for name_id in self.by_rank[:max(limit, 0)]]
+
+        lo = bisect_left(self.upper, search_term)
+        hi = bisect_right(self.upper, search_term + chr(0x10FFFF), lo)
+
+        results = heapq.nsmallest(limit, range(lo, hi), key=self.ranks.__getitem__)
+        if len(results) < limit:
+            # Candidates arrive in rank order, so the first hits are the best ones
+            substring_hits = (
+                name_id for name_id in self._substring_candidates(search_term)
+                if not lo <= name_id < hi
+            )
+            results += islice(substring_hits, limit - len(results))
+
+        return [self.names[name_id] for name_id in results]
+
+
+# Turkish letters folded to their ASCII base so "İ/ı/i/I" and "ş/s" etc. all match
+TURKISH_FOLD = str.maketrans({
+    'ı': 'I', 'i': 'I', 'İ': 'I',
+    'ç': 'C', 'Ç': 'C',
+    'ğ': 'G', 'Ğ': 'G',
+    'ö': 'O', 'Ö': 'O',
+    'ş': 'S', 'Ş': 'S',
+    'ü': 'U', 'Ü': 'U',
+})
+
+# Fuzzy search bounds: result count, minimum trigram overlap and per-query work
+MAX_FUZZY_RESULTS = 50
+FUZZY_MIN_SIMILARITY = 0.5
+FUZZY_MAX_POSTINGS = 20000
+# Candidates from the rare trigrams that are re-scored against the full query
+FUZZY_MAX_CANDIDATES = 500
+
+
+def fold_medicine_name(name: str) -> str:
+    """Case- and accent-fold a name the way Turkish users type it."""
+    return ' '.join(name.translate(TURKISH_FOLD).upper().split())
+
+
+def trigrams(folded: str) -> Set[str]:
+    padded = f"  {folded} "
+    return {padded[start:start + 3] for start in range(len(padded) - 2)}
+
+
+class FuzzySearchIndex:
+    """
+    Typo-tolerant search using trigram posting lists over folded names.
+
+    A name's score is the share of the query's trigrams it contains, so a
+    misspelled prefix like "PAROLL" still finds "PAROL 500 MG 20 TABLET".
+    Candidates come from walking only the rarest query trigrams, up to
+    FUZZY_MAX_POSTINGS ids; the best of them are then scored against every
+    query trigram, so common tokens like "TABLET" still count.
+    """
+
+    def __init__(self, names):
+        self.names = sorted(names, key=lambda name: (len(name), name.upper()))
+
+        postings = {}
+        for name_id, name in enumerate(self.names):
+            for gram in trigrams(fold_medicine_name(name)):
+                postings.setdefault(gram, []).append(name_id)
+        self.postings = {gram: array('I', ids) for gram, ids in postings.items()}
+
+    def search(self, search_term: str, limit: int) -> List[str]:
+        query_grams = trigrams(fold_medicine_name(search_term))
+        gram_postings = sorted(
+            (self.postings.get(gram, ()) for gram in query_grams),
+            key=len
+        )
+
+        shared = {}
+        visited = 0
+        visited_grams = 0
+        for ids in gram_postings:
+            if visited + len(ids) > FUZZY_MAX_POSTINGS and shared:
+                break
+            visited += len(ids)
+            visited_grams += 1
+            for name_id in ids:
+                shared[name_id] = shared.get(name_id, 0) + 1
+
+        # Shortlist on the trigrams actually walked, then score the shortlist
+        # against the whole query
+        min_partial = FUZZY_MIN_SIMILARITY * visited_grams
+        candidates = heapq.nsmallest(
+            FUZZY_MAX_CANDIDATES,
+            (name_id for name_id, count in shared.items() if count >= min_partial),
+            key=lambda name_id: (-shared[name_id], name_id)
+        )
+        if visited_grams < len(query_grams):
+            shared = {
+                name_id: len(query_grams & trigrams(fold_medicine_name(self.names[name_id])))
+                for name_id in candidates
+            }
+
+        # Names are stored in relevance order, so ties go to the shorter name
+        min_shared = FUZZY_MIN_SIMILARITY * len(query_grams)
+        matches = heapq.nsmallest(
+            limit,
+            (name_id for name_id in candidates if shared[name_id] >= min_shared),
+            key=lambda name_id: (-shared[name_id], name_id)
+        )
+        return [self.names[name_id] for name_id in matches]
+
+
+# Target false-positive rate of the published catalog Bloom filter
+BLOOM_FALSE_POSITIVE_RATE = float(os.getenv('BLOOM_FALSE_POSITIVE_RATE', '0.01'))
+CATALOG_BLOOM_KEY = 'catalog:bloom'
+
+
+class BloomFilter:
+    """
+    Compact membership filter with no false negatives.
+
+    Positions come from one 128-bit blake2b digest split into two halves
+    (double hashing), so any client can rebuild the same probes from the
+    published bit_count and hash_count.
+    """
+
+    def __init__(self, bit_count: int, hash_count: int):
+        self.bit_count = bit_count
+        self.hash_count = hash_count
+        self.bits = bytearray((bit_count + 7) // 8)
+        self.item_count = 0
+
+    @classmethod
+    def build(cls, items, false_positive_rate: float):
+        item_count = max(len(items), 1)
+        bit_count = max(8, math.ceil(-item_count * math.log(false_positive_rate) / math.log(2) ** 2))
+        hash_count = max(1, round(bit_count / item_count * math.log(2)))
+        bloom = cls(bit_count, hash_count)
         for item in items:
-            try:
-                container.delete_item(item=item['id'], partition_key=item['id'])
-            except Exception as delete_error:
-                print(f"Error deleting item {item['id']}: {str(delete_error)}")
-                # Continue with other items even if one fails
-                continue
-        
-        # Create new document
-        new_item = {
-            'id': str(uuid.uuid4()),  # Required for Cosmos DB
-            'medicines': medicine_prices,
-            'type': 'medicine_list'  # Adding a type identifier
+            bloom.add(item)
+        return bloom
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.bit_count for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.item_count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def false_positive_rate(self) -> float:
+        return (1 - math.exp(-self.hash_count * self.item_count / self.bit_count)) ** self.hash_count
+
+    def stats(self) -> dict:
+        return {
+            "items": self.item_count,
+            "bits": self.bit_count,
+            "hashes": self.hash_count,
+            "size_bytes": len(self.bits),
+            "false_positive_rate": round(self.false_positive_rate(), 6)
         }
-        
-        # Create the new item
+
+
+class CatalogIndex:
+    """Read-only, versioned snapshot of the medicine catalog kept in process.
+
+    Instances are never mutated after construction; a new catalog is published
+    by building a fresh index and swapping the module-level reference.
+    """
+
+    def __init__(self, version: int, prices: dict):
+        self.version = version
+        self.prices = dict(prices)
+        self.names = frozenset(self.prices)
+        self.warmed = False
+        self._warm_task: Union[asyncio.Future, None] = None
+
+    # Search structures are built by warm() so that exact lookups are
+    # available as soon as the prices are loaded; async callers go through
+    # ready() so the build never runs on the event loop
+    @cached_property
+    def search(self) -> NameSearchIndex:
+        return NameSearchIndex(self.names)
+
+    @cached_property
+    def fuzzy(self) -> FuzzySearchIndex:
+        return FuzzySearchIndex(self.names)
+
+    @cached_property
+    def bloom(self) -> BloomFilter:
+        return BloomFilter.build(self.names, BLOOM_FALSE_POSITIVE_RATE)
+
+    def warm(self):
+        """Build every search structure now instead of on first use."""
+        for structure in ('search', 'fuzzy', 'bloom'):
+            getattr(self, structure)
+        self.warmed = True
+
+    async def ready(self) -> 'CatalogIndex':
+        """
+        Wait until the search structures are built. The first caller starts a
+        single build in a worker thread and every other caller awaits it.
+        """
+        if self.warmed:
+            return self
+        if self._warm_task is None:
+            self._warm_task = asyncio.ensure_future(asyncio.to_thread(self.warm))
+        await asyncio.shield(self._warm_task)
+        return self
+
+    def __contains__(self, medicine_name: str) -> bool:
+        return medicine_name in self.names
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def get_price(self, medicine_name: str):
+        return self.prices.get(medicine_name)
+
+
+catalog_index: Union[CatalogIndex, None] = None
+catalog_checked_at = 0.0
+
+
+def build_catalog_index(version: int, prices: dict) -> CatalogIndex:
+    """Build a snapshot with all of its search structures ready (CPU-bound)."""
+    index = CatalogIndex(version, prices)
+    index.warm()
+    return index
+
+
+# Compact on-disk copy of the catalog used to boot without waiting for Cosmos DB.
+# Layout: header (magic, version, count), int64 prices, uint32 name offsets
+# (count + 1) and the UTF-8 names blob, names sorted.
+CATALOG_SNAPSHOT_PATH = os.getenv('CATALOG_SNAPSHOT_PATH', os.path.join('snapshots', 'catalog.bin'))
+SNAPSHOT_MAGIC = b'MEDCAT01'
+SNAPSHOT_HEADER = struct.Struct('<8sqI')
+
+
+def write_catalog_snapshot(index: CatalogIndex, path: str):
+    names = sorted(index.prices)
+    encoded = [name.encode('utf-8') for name in names]
+    offsets = array('I', [0])
+    for name in encoded:
+        offsets.append(offsets[-1] + len(name))
+    prices = array('q', (index.prices[name] for name in names))
+
+    # Write next to the target and rename, so readers never see a partial file
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, index.version, len(names)))
+        f.write(prices.tobytes())
+        f.write(offsets.tobytes())
+        f.write(b''.join(encoded))
+    os.replace(temp_path, path)
+
+
+def load_catalog_snapshot(path: str) -> Union[CatalogIndex, None]:
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        magic, version, count = SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC:
+            print(f"Ignoring catalog snapshot {path}: unknown format")
+            return None
+
+        prices_start = SNAPSHOT_HEADER.size
+        offsets_start = prices_start + 8 * count
+        names_start = offsets_start + 4 * (count + 1)
+
+        prices = array('q')
+        prices.frombytes(data[prices_start:offsets_start])
+        offsets = array('I')
+        offsets.frombytes(data[offsets_start:names_start])
+        blob = data[names_start:]
+
+    return CatalogIndex(version, {
+        blob[offsets[i]:offsets[i + 1]].decode('utf-8'): prices[i]
+        for i in range(count)
+    })
+
+
+async def install_catalog_index(index: CatalogIndex):
+    """Publish a new snapshot in process and persist it for the next boot."""
+    set_catalog_index(index)
+    try:
+        await asyncio.to_thread(write_catalog_snapshot, index, CATALOG_SNAPSHOT_PATH)
+    except OSError as e:
+        print(f"Failed to write catalog snapshot: {str(e)}")
+
+
+def set_catalog_index(index: CatalogIndex):
+    """Atomically publish a new catalog snapshot to all handlers."""
+    global catalog_index, catalog_checked_at
+    catalog_index = index
+    catalog_checked_at = time.monotonic()
+
+
+async def read_catalog_pointer():
+    """Point-read the document naming the current catalog version and its chunks."""
+    try:
+        return await container.read_item(item=CATALOG_POINTER_ID, partition_key=CATALOG_POINTER_ID)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+
+
+def catalog_chunk_of(medicine_name: str) -> int:
+    return zlib.crc32(medicine_name.encode('utf-8')) % CATALOG_CHUNKS
+
+
+async def load_legacy_catalog_index() -> CatalogIndex:
+    """Build an index from the single-document layout used before chunking."""
+    query = "SELECT * FROM c WHERE c.type = 'medicine_list'"
+    items = [item async for item in container.query_items(query=query)]
+
+    version = 0
+    all_medicines = {}
+    for item in items:
+        all_medicines.update(item.get('medicines', {}))
+        version = max(version, item.get('version', 0))
+
+    return await asyncio.to_thread(build_catalog_index, version, all_medicines)
+
+
+async def load_catalog_index() -> CatalogIndex:
+    """Read the current catalog chunks from Cosmos DB and build a new index."""
+    for _ in range(3):
+        pointer = await read_catalog_pointer()
+        if pointer is None:
+            return await load_legacy_catalog_index()
+
+        chunk_ids = list(pointer['chunks'].values())
+        items = [
+            item async for item in container.query_items(
+                query="SELECT * FROM c WHERE ARRAY_CONTAINS(@ids, c.id)",
+                parameters=[{'name': '@ids', 'value': chunk_ids}]
+            )
+        ]
+
+        # A writer may have flipped the pointer and removed old chunks meanwhile
+        if len(items) != len(chunk_ids):
+            continue
+
+        all_medicines = {}
+        for item in items:
+            all_medicines.update(item['medicines'])
+        # Building the search structures is CPU-bound; keep it off the event loop
+        return await asyncio.to_thread(build_catalog_index, pointer['version'], all_medicines)
+
+    raise RuntimeError("Catalog changed while it was being read")
+
+
+async def fetch_catalog_version() -> int:
+    """Return the version of the stored catalog without reading the medicines."""
+    pointer = await read_catalog_pointer()
+    if pointer is not None:
+        return pointer['version']
+
+    query = "SELECT VALUE c.version FROM c WHERE c.type = 'medicine_list'"
+    versions = [version async for version in container.query_items(query=query)]
+    return max((v for v in versions if v is not None), default=0)
+
+
+def diff_catalog(old_prices: dict, new_prices: dict):
+    """Return the (added, removed, repriced) medicine names between two catalogs."""
+    added = new_prices.keys() - old_prices.keys()
+    removed = old_prices.keys() - new_prices.keys()
+    repriced = {
+        name for name in new_prices.keys() & old_prices.keys()
+        if new_prices[name] != old_prices[name]
+    }
+    return added, removed, repriced
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one execution.
+    The first caller runs the coroutine; later callers await its result.
+    """
+
+    def __init__(self):
+        self.inflight = {}
+
+    async def do(self, key: str, fn, *args):
+        future = self.inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
         try:
-            container.create_item(body=new_item)
-            
-            # Clear Redis cache as data has changed
-            try:
-                redis_client.flushdb()
-            except redis.RedisError as e:
-                print(f"Failed to clear Redis cache: {str(e)}")
-                
-            return True
-            
+            result = await fn(*args)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            del self.inflight[key]
+            # The leader was cancelled; fail the waiters instead of leaving them hanging
+            if not future.done():
+                future.set_exception(RuntimeError(f"Call for {key!r} was cancelled"))
+                future.exception()
+
+
+catalog_flight = SingleFlight()
+
+
+async def refresh_catalog_index(force_check: bool) -> CatalogIndex:
+    global catalog_checked_at
+    if catalog_index is None:
+        await install_catalog_index(await load_catalog_index())
+    elif force_check:
+        try:
+            if await fetch_catalog_version() != catalog_index.version:
+                await install_catalog_index(await load_catalog_index())
+            else:
+                catalog_checked_at = time.monotonic()
+        except Exception as e:
+            # Keep serving the snapshot we already have
+            print(f"Failed to refresh catalog index: {str(e)}")
+            catalog_checked_at = time.monotonic()
+    return catalog_index
+
+
+async def get_catalog_index(force_check: bool = False) -> CatalogIndex:
+    """
+    Return the current catalog snapshot, loading it on first use.
+    With `force_check` the stored version is compared first. Once a snapshot
+    is loaded, requests never wait on Cosmos DB; poll_catalog_version does
+    the periodic check. Concurrent loads share a single Cosmos DB read.
+    """
+    if catalog_index is not None and not force_check:
+        return catalog_index
+    return await catalog_flight.do('catalog', refresh_catalog_index, force_check)
+
+
+async def poll_catalog_version():
+    """
+    Background check of the stored catalog version every
+    CATALOG_REFRESH_SECONDS, so replicas pick up catalogs written by other
+    instances even when a catalog:updates message was missed.
+    """
+    while True:
+        next_check = catalog_checked_at + CATALOG_REFRESH_SECONDS
+        await asyncio.sleep(max(next_check - time.monotonic(), 1))
+        try:
+            await get_catalog_index(force_check=True)
+        except Exception as e:
+            print(f"Failed to refresh catalog index: {str(e)}")
+            await asyncio.sleep(CATALOG_REFRESH_SECONDS)
+
+
+async def get_search_ready_index() -> CatalogIndex:
+    """Return the current catalog snapshot once its search structures are built."""
+    return await (await get_catalog_index()).ready()
+
+
+async def publish_bloom_filter(index: CatalogIndex):
+    """Share the catalog Bloom filter through Redis for clients without a snapshot."""
+    try:
+        await redis_client.hset(CATALOG_BLOOM_KEY, mapping={
+            'version': index.version,
+            'bit_count': index.bloom.bit_count,
+            'hash_count': index.bloom.hash_count,
+            'bits': base64.b64encode(index.bloom.bits).decode('ascii')
+        })
+    except redis.RedisError as e:
+        print(f"Failed to publish Bloom filter: {str(e)}")
+
+
+async def reconcile_catalog():
+    """
+    Background startup work: create the Cosmos DB resources if needed, finish
+    building the search structures of a snapshot loaded from disk, and bring
+    the catalog up to date with the stored version.
+    """
+    global container
+
+    # Build the snapshot's search structures while Cosmos DB is being set up
+    warming = asyncio.create_task(catalog_index.ready()) if catalog_index is not None else None
+
+    # Create database if it doesn't exist
+    try:
+        database = await cosmos_client.create_database_if_not_exists(id=settings['database_id'])
+    except Exception as e:
+        print(f"Error creating database: {str(e)}")
+        database = cosmos_client.get_database_client(settings['database_id'])
+
+    # Create container if it doesn't exist
+    try:
+        container = await database.create_container_if_not_exists(
+            id=settings['container_id'],
+            partition_key=PartitionKey(path="/id"),
+            offer_throughput=400
+        )
+    except Exception as e:
+        print(f"Error creating container: {str(e)}")
+
+    if warming is not None:
+        await warming
+
+    try:
+        await get_catalog_index(force_check=True)
+    except Exception as e:
+        print(f"Failed to load catalog index: {str(e)}")
+
+
+async def save_to_cosmosdb(medicine_prices: dict, changed_names: Union[Set[str], None] = None,
+                           base_version: Union[int, None] = None) -> Union[int, None]:
+    """
+    Persist the catalog as CATALOG_CHUNKS chunk documents plus a version pointer.
+
+    Only chunks holding a name in `changed_names` are rewritten (all of them
+    when it is None). `changed_names` must be the diff against catalog
+    `base_version`; if the stored catalog is a different version, unchanged
+    chunks cannot be reused and every chunk is rewritten. New chunks are written under the new version first and
+    the pointer is flipped afterwards, so readers never see a partial or empty
+    catalog. Superseded chunks are deleted once the pointer has moved.
+
+    The pointer is only replaced if nobody else moved it since it was read;
+    a writer that loses that race deletes its own chunks and fails. Returns
+    the new version, or None on failure.
+    """
+    try:
+        pointer = await read_catalog_pointer()
+        previous_chunks = pointer['chunks'] if pointer is not None else {}
+        # Small sequential versions; Cosmos DB stores numbers as doubles
+        version = pointer['version'] + 1 if pointer is not None else 1
+        # Concurrent writers derive the same version, so chunk ids also carry
+        # a per-write suffix to keep their documents apart
+        write_id = uuid.uuid4().hex[:8]
+        if (changed_names is None or pointer is None
+                or pointer['version'] != base_version
+                or pointer.get('chunk_count') != CATALOG_CHUNKS):
+            # First write, full rewrite, a diff against another version or
+            # re-chunking: every chunk is new
+            changed_chunks = set(range(CATALOG_CHUNKS))
+            kept_chunks = {}
+        else:
+            changed_chunks = {catalog_chunk_of(name) for name in changed_names}
+            kept_chunks = previous_chunks
+
+        chunk_medicines = {chunk: {} for chunk in changed_chunks}
+        for name, price in medicine_prices.items():
+            chunk = catalog_chunk_of(name)
+            if chunk in chunk_medicines:
+                chunk_medicines[chunk][name] = price
+
+        new_chunks = {str(chunk): f"chunk-{chunk}-{version}-{write_id}" for chunk in changed_chunks}
+        new_items = [
+            {
+                'id': new_chunks[str(chunk)],
+                'medicines': medicines,
+                'version': version,
+                'type': 'medicine_chunk'
+            }
+            for chunk, medicines in chunk_medicines.items()
+        ]
+
+        write_slots = asyncio.Semaphore(COSMOS_WRITE_CONCURRENCY)
+
+        async def upsert_chunk(item):
+            async with write_slots:
+                await container.upsert_item(body=item)
+
+        async def delete_item(item_id):
+            async with write_slots:
+                try:
+                    await container.delete_item(item=item_id, partition_key=item_id)
+                except Exception as delete_error:
+                    print(f"Error deleting item {item_id}: {str(delete_error)}")
+
+        try:
+            await asyncio.gather(*(upsert_chunk(item) for item in new_items))
         except Exception as create_error:
-            print(f"Error creating new item: {str(create_error)}")
-            return False
-            
+            print(f"Error writing catalog chunks: {str(create_error)}")
+            await asyncio.gather(*(delete_item(item_id) for item_id in new_chunks.values()))
+            return None
+
+        # Flip the pointer; this is the moment readers switch catalogs
+        chunks = {**kept_chunks, **new_chunks}
+        pointer_body = {
+            'id': CATALOG_POINTER_ID,
+            'version': version,
+            'chunk_count': CATALOG_CHUNKS,
+            'chunks': chunks,
+            'type': 'catalog_pointer'
+        }
+        try:
+            if pointer is None:
+                await container.create_item(body=pointer_body)
+            else:
+                await container.replace_item(
+                    item=CATALOG_POINTER_ID,
+                    body=pointer_body,
+                    etag=pointer['_etag'],
+                    match_condition=MatchConditions.IfNotModified
+                )
+        except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceExistsError):
+            # Another update moved the pointer first; our chunks were never live
+            print("Catalog pointer changed during update, discarding this write")
+            await asyncio.gather(*(delete_item(item_id) for item_id in new_chunks.values()))
+            return None
+
+        # Remove superseded chunks and, on first write, the legacy document
+        live_ids = set(chunks.values())
+        stale_ids = [
+            chunk_id for chunk_id in previous_chunks.values()
+            if chunk_id not in live_ids
+        ]
+        if pointer is None:
+            stale_ids += [
+                item['id'] async for item in container.query_items(
+                    query="SELECT c.id FROM c WHERE c.type = 'medicine_list'"
+                )
+            ]
+
+        await asyncio.gather(*(delete_item(item_id) for item_id in stale_ids))
+
+        return version
+
     except Exception as e:
         print(f"Cosmos DB Error: {str(e)}")
-        return False
+        return None
 
 @app.get("/")
 def read_root():
@@ -108,12 +827,59 @@ def read_item(item_id: int, q: Union[str, None] = None):
     return {"item_id": item_id, "q": q}
 
 
+# Sheets of the TITCK workbook holding medicine names (first column, data from row 5)
+MEDICINE_SHEETS = ["AKTİF ÜRÜNLER LİSTESİ", "PASİF ÜRÜNLER LİSTESİ"]
+MEDICINE_FIRST_ROW = 5
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Redis hash remembering the last ingested workbook (url, etag, last_modified, sha256)
+CATALOG_SOURCE_KEY = 'catalog:source'
+
+
+def iter_medicine_names(filepath: str):
+    """Stream medicine names from all sheets in one read-only pass over the workbook."""
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        for sheet_name in MEDICINE_SHEETS:
+            if sheet_name not in workbook.sheetnames:
+                print(f"Error reading sheet {sheet_name}: sheet not found")
+                continue
+            rows = workbook[sheet_name].iter_rows(min_row=MEDICINE_FIRST_ROW, max_col=1, values_only=True)
+            for (name,) in rows:
+                if isinstance(name, str) and name.strip():
+                    yield name.strip()
+    finally:
+        workbook.close()
+
+
+def read_medicine_names(filepath: str) -> List[str]:
+    return list(iter_medicine_names(filepath))
+
+
+async def read_catalog_source() -> dict:
+    try:
+        return await redis_client.hgetall(CATALOG_SOURCE_KEY)
+    except redis.RedisError as e:
+        print(f"Failed to read catalog source state: {str(e)}")
+        return {}
+
+
+async def save_catalog_source(download_result: dict):
+    try:
+        await redis_client.hset(CATALOG_SOURCE_KEY, mapping={
+            field: download_result.get(field) or ''
+            for field in ('url', 'etag', 'last_modified', 'sha256')
+        })
+    except redis.RedisError as e:
+        print(f"Failed to save catalog source state: {str(e)}")
+
+
 @app.get("/download-latest-xlsx")
-def download_latest_xlsx():
+async def download_latest_xlsx(force: bool = False):
     try:
         # Send GET request to the webpage
         url = "https://www.titck.gov.tr/dinamikmodul/43"
-        response = requests.get(url)
+        response = await http_client.get(url)
         response.raise_for_status()
         
         # Parse HTML content using BeautifulSoup
@@ -132,10 +898,6 @@ def download_latest_xlsx():
             
         xlsx_url = xlsx_link['href']
         
-        # Download the XLSX file
-        file_response = requests.get(xlsx_url)
-        file_response.raise_for_status()
-        
         # Create downloads directory if it doesn't exist
         os.makedirs('downloads', exist_ok=True)
         
@@ -143,27 +905,57 @@ def download_latest_xlsx():
         filename = xlsx_url.split('/')[-1] if '/' in xlsx_url else 'latest.xlsx'
         filepath = os.path.join('downloads', filename)
         
-        # Save the file
-        with open(filepath, 'wb') as f:
-            f.write(file_response.content)
+        # Ask the server to skip the body if we already ingested this file,
+        # unless a forced update needs the body regardless
+        source = await read_catalog_source()
+        headers = {}
+        if source.get('url') == xlsx_url and not force:
+            if source.get('etag'):
+                headers['If-None-Match'] = source['etag']
+            if source.get('last_modified'):
+                headers['If-Modified-Since'] = source['last_modified']
+        
+        # Stream the XLSX file to disk, hashing it on the way
+        async with http_client.stream("GET", xlsx_url, headers=headers) as file_response:
+            if file_response.status_code == 304:
+                return {
+                    "message": "File not modified since last ingest",
+                    "filename": filename,
+                    "filepath": None,
+                    "url": xlsx_url,
+                    "unchanged": True
+                }
+            file_response.raise_for_status()
             
-        return {
-            "message": "File downloaded successfully",
-            "filename": filename,
-            "filepath": filepath
-        }
+            digest = hashlib.sha256()
+            with open(filepath, 'wb') as f:
+                async for chunk in file_response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+            
+            sha256 = digest.hexdigest()
+            return {
+                "message": "File downloaded successfully",
+                "filename": filename,
+                "filepath": filepath,
+                "url": xlsx_url,
+                "etag": file_response.headers.get('ETag'),
+                "last_modified": file_response.headers.get('Last-Modified'),
+                "sha256": sha256,
+                "unchanged": sha256 == source.get('sha256')
+            }
         
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         return {"error": f"Request failed: {str(e)}"}
     except Exception as e:
         return {"error": f"An error occurred: {str(e)}"}
 
 
 @app.get("/update-medicine-prices")
-async def update_medicine_prices():
+async def update_medicine_prices(force: bool = False):
     try:
         # Download Excel file
-        download_result = download_latest_xlsx()
+        download_result = await download_latest_xlsx(force)
         
         if "error" in download_result:
             return download_result
@@ -171,108 +963,96 @@ async def update_medicine_prices():
         filepath = download_result["filepath"]
         
         try:
-            # Read both sheets from Excel
-            medicine_names = []
-            
-            # Read Active Products sheet
-            try:
-                df_active = pd.read_excel(filepath, sheet_name="AKTİF ÜRÜNLER LİSTESİ", skiprows=3)
-                active_names = df_active.iloc[:, 0].dropna().tolist()
-                medicine_names.extend([name.strip() for name in active_names if isinstance(name, str)])
-            except Exception as e:
-                print(f"Error reading active products sheet: {str(e)}")
+            # Skip the whole ingest when the workbook is the one we already loaded
+            if download_result["unchanged"] and not force:
+                return {
+                    "message": "Medicine list unchanged since last update",
+                    "skipped": True,
+                    "filename": download_result["filename"]
+                }
             
-            # Read Passive Products sheet
-            try:
-                df_passive = pd.read_excel(filepath, sheet_name="PASİF ÜRÜNLER LİSTESİ", skiprows=3)
-                passive_names = df_passive.iloc[:, 0].dropna().tolist()
-                medicine_names.extend([name.strip() for name in passive_names if isinstance(name, str)])
-            except Exception as e:
-                print(f"Error reading passive products sheet: {str(e)}")
+            # Parsing the workbook is CPU-bound; keep it off the event loop
+            medicine_names = await asyncio.to_thread(read_medicine_names, filepath)
             
             if not medicine_names:
                 return {"error": "No medicine names found in Excel file"}
             
-            # Create prices dictionary
+            # Create prices dictionary, keeping the price of medicines we already list
+            current = await get_catalog_index(force_check=True)
             medicine_prices = {
-                name: random.randint(20, 70) 
+                name: current.prices.get(name, random.randint(20, 70))
                 for name in medicine_names
             }
+            added, removed, repriced = diff_catalog(current.prices, medicine_prices)
+            changed_names = added | removed | repriced
             
-            # Save to Cosmos DB
-            cosmos_save_success = await save_to_cosmosdb(medicine_prices)
+            if not changed_names:
+                await save_catalog_source(download_result)
+                return {
+                    "message": "Medicine prices are already up to date",
+                    "count": len(medicine_prices),
+                    "version": current.version,
+                    "changes": {"added": 0, "removed": 0, "repriced": 0},
+                    "saved_to_cosmosdb": True,
+                    "replicas_notified": False
+                }
             
-            # Clear Redis cache
-            try:
-                redis_client.flushdb()
-                cache_cleared = True
-            except redis.RedisError as e:
-                print(f"Failed to clear Redis cache: {str(e)}")
-                cache_cleared = False
+            # Save only the changed chunks to Cosmos DB; the diff is against
+            # our snapshot, which may lag the stored catalog
+            version = await save_to_cosmosdb(medicine_prices, changed_names, current.version)
+            cosmos_save_success = version is not None
+
+            # Swap in the new snapshot so lookups see it immediately
+            if cosmos_save_success:
+                await save_catalog_source(download_result)
+                await install_catalog_index(await asyncio.to_thread(build_catalog_index, version, medicine_prices))
+                await publish_bloom_filter(catalog_index)
+            
+            # Let the other replicas pick up the new catalog right away
+            replicas_notified = False
+            if cosmos_save_success:
+                try:
+                    await publish_catalog_update(version)
+                    replicas_notified = True
+                except redis.RedisError as e:
+                    print(f"Failed to publish catalog update: {str(e)}")
             
             return {
                 "message": "Medicine prices updated successfully" + 
-                          (" and saved to Cosmos DB" if cosmos_save_success else " but failed to save to Cosmos DB") +
-                          (" and cache cleared" if cache_cleared else " but failed to clear cache"),
+                          (" and saved to Cosmos DB" if cosmos_save_success else " but failed to save to Cosmos DB"),
                 "count": len(medicine_prices),
+                "version": version if cosmos_save_success else current.version,
+                "changes": {
+                    "added": len(added),
+                    "removed": len(removed),
+                    "repriced": len(repriced)
+                },
                 "saved_to_cosmosdb": cosmos_save_success,
-                "cache_cleared": cache_cleared
+                "replicas_notified": replicas_notified,
+                "bloom_filter": catalog_index.bloom.stats() if cosmos_save_success else None
             }
             
         finally:
             # Clean up: Delete the downloaded file
-            if os.path.exists(filepath):
+            if filepath and os.path.exists(filepath):
                 os.remove(filepath)
                 
     except Exception as e:
         return {"error": f"An error occurred: {str(e)}"}
 
+# Lookup counters, exposed on /lookup-stats
+lookup_stats = Counter()
+
 @app.get("/find-medicine/{medicine_name}")
 async def find_medicine(medicine_name: str):
     try:
-        # First check Redis cache
-        cached_result = redis_client.get(medicine_name)
-        if cached_result is not None:
-            return {
-                "exists": json.loads(cached_result),
-                "medicine_name": medicine_name,
-                "source": "cache"
-            }
-        
-        # If not in cache, query Cosmos DB
-        query = "SELECT * FROM c WHERE IS_DEFINED(c.medicines)"
-        items = list(container.query_items(
-            query=query,
-            enable_cross_partition_query=True
-        ))
-        
-        # Check if medicine exists in any document
-        exists = any(
-            medicine_name in item.get('medicines', {})
-            for item in items
-        )
-        
-        # Cache the result in Redis (with 1 hour expiration)
-        redis_client.setex(
-            medicine_name,
-            3600,  # 1 hour in seconds
-            json.dumps(exists)
-        )
-        
+        # The in-process catalog snapshot is authoritative; no cache tier can answer faster
+        exists = medicine_name in await get_catalog_index()
+        lookup_stats['found' if exists else 'not_found'] += 1
         return {
             "exists": exists,
             "medicine_name": medicine_name,
-            "source": "database"
-        }
-        
-    except redis.RedisError as e:
-        print(f"Redis Error: {str(e)}")
-        # If Redis fails, still return the database result
-        return {
-            "exists": exists,
-            "medicine_name": medicine_name,
-            "source": "database",
-            "cache_error": str(e)
+            "source": "index"
         }
     except Exception as e:
         return {"error": f"An error occurred: {str(e)}"}
@@ -287,69 +1067,24 @@ async def find_medicines(request: MedicineListRequest):
         results = {
             "existing_medicines": [],
             "non_existing_medicines": [],
-            "cache_hits": [],
-            "database_hits": [],
-            "total_searched": len(request.names)
+            "total_searched": len(request.names),
+            "source": "index"
         }
         
-        # First check Redis cache for all medicines
-        cache_results = {}
+        index = await get_catalog_index()
         for medicine_name in request.names:
-            cached_result = redis_client.get(medicine_name)
-            if cached_result is not None:
-                exists = json.loads(cached_result)
-                cache_results[medicine_name] = exists
-                results["cache_hits"].append(medicine_name)
-                if exists:
-                    results["existing_medicines"].append(medicine_name)
-                else:
-                    results["non_existing_medicines"].append(medicine_name)
-        
-        # Get remaining medicines that weren't in cache
-        medicines_to_check = [
-            name for name in request.names 
-            if name not in cache_results
-        ]
-        
-        if medicines_to_check:
-            # Query Cosmos DB once for all medicines
-            query = "SELECT * FROM c WHERE IS_DEFINED(c.medicines)"
-            items = list(container.query_items(
-                query=query,
-                enable_cross_partition_query=True
-            ))
-            
-            # Get all medicines from the database
-            all_medicines = {}
-            for item in items:
-                all_medicines.update(item.get('medicines', {}))
-            
-            # Check each medicine and update cache
-            for medicine_name in medicines_to_check:
-                exists = medicine_name in all_medicines
-                results["database_hits"].append(medicine_name)
-                
-                if exists:
-                    results["existing_medicines"].append(medicine_name)
-                else:
-                    results["non_existing_medicines"].append(medicine_name)
-                
-                # Cache the result
-                try:
-                    redis_client.setex(
-                        medicine_name,
-                        3600,  # 1 hour in seconds
-                        json.dumps(exists)
-                    )
-                except redis.RedisError as e:
-                    print(f"Failed to cache result for {medicine_name}: {str(e)}")
+            if medicine_name in index:
+                results["existing_medicines"].append(medicine_name)
+            else:
+                results["non_existing_medicines"].append(medicine_name)
+        lookup_stats['found'] += len(results["existing_medicines"])
+        lookup_stats['not_found'] += len(results["non_existing_medicines"])
+        lookup_stats['batches'] += 1
         
         # Add summary statistics
         results["summary"] = {
             "total_existing": len(results["existing_medicines"]),
-            "total_non_existing": len(results["non_existing_medicines"]),
-            "cache_hit_count": len(results["cache_hits"]),
-            "database_hit_count": len(results["database_hits"])
+            "total_non_existing": len(results["non_existing_medicines"])
         }
         
         return results
@@ -357,68 +1092,94 @@ async def find_medicines(request: MedicineListRequest):
     except Exception as e:
         return {"error": f"An error occurred: {str(e)}"}
 
+# Same shape as Prescription.data in prescription_service: [[name, quantity], ...]
+class PrescriptionPricingRequest(BaseModel):
+    data: List[Tuple[str, conint(gt=0)]]
+
+MAX_PRICING_LINES = 1000
+
+@app.post("/price-prescription")
+async def price_prescription(request: PrescriptionPricingRequest):
+    """Price every line of a prescription in one pass over the catalog snapshot."""
+    try:
+        if len(request.data) > MAX_PRICING_LINES:
+            return {"error": f"At most {MAX_PRICING_LINES} lines can be priced per request"}
+        
+        prices = (await get_catalog_index()).prices
+        lines = []
+        unpriced_medicines = []
+        total = 0
+        for medicine_name, quantity in request.data:
+            unit_price = prices.get(medicine_name)
+            if unit_price is None:
+                unpriced_medicines.append(medicine_name)
+                line_total = None
+            else:
+                line_total = unit_price * quantity
+                total += line_total
+            lines.append({
+                "medicine_name": medicine_name,
+                "quantity": quantity,
+                "unit_price": unit_price,
+                "line_total": line_total
+            })
+        
+        return {
+            "lines": lines,
+            "total": total,
+            "priced_count": len(lines) - len(unpriced_medicines),
+            "unpriced_medicines": unpriced_medicines
+        }
+        
+    except Exception as e:
+        return {"error": f"An error occurred: {str(e)}"}
+
+@app.get("/lookup-stats")
+async def get_lookup_stats():
+    found = lookup_stats['found']
+    not_found = lookup_stats['not_found']
+    return {
+        "lookups": found + not_found,
+        "found": found,
+        "not_found": not_found,
+        "found_rate": round(found / (found + not_found), 4) if found + not_found else None,
+        "batch_requests": lookup_stats['batches'],
+        "catalog_version": catalog_index.version if catalog_index is not None else None,
+        "catalog_size": len(catalog_index) if catalog_index is not None else None
+    }
+
 @app.get("/find-similar/{partial_name}")
 async def find_similar(partial_name: str, limit: int = 10):
     try:
         # Normalize the search term (uppercase and remove extra spaces)
         search_term = partial_name.upper().strip()
-        cache_key = f"similar:{search_term}"
-        
-        # Check cache first
-        cached_result = redis_client.get(cache_key)
-        if cached_result is not None:
-            return {
-                "similar_medicines": json.loads(cached_result),
-                "count": len(json.loads(cached_result)),
-                "search_term": partial_name,
-                "source": "cache"
-            }
-        
-        # If not in cache, search in Cosmos DB
-        query = "SELECT * FROM c WHERE IS_DEFINED(c.medicines)"
-        items = list(container.query_items(
-            query=query,
-            enable_cross_partition_query=True
-        ))
-        
-        # Get all medicine names from the database
-        all_medicines: Set[str] = set()
-        for item in items:
-            all_medicines.update(item.get('medicines', {}).keys())
-        
-        # Find similar medicines
-        similar_medicines = []
-        for medicine in all_medicines:
-            # Convert both strings to uppercase for case-insensitive comparison
-            if search_term in medicine.upper():
-                similar_medicines.append(medicine)
-        
-        # Sort by relevance (exact matches first, then by length)
-        similar_medicines.sort(key=lambda x: (
-            not x.upper().startswith(search_term),  # Exact prefix matches first
-            len(x),                                 # Shorter names next
-            x.upper()                              # Alphabetical order
-        ))
-        
-        # Limit results
-        similar_medicines = similar_medicines[:limit]
-        
-        # Cache the results
-        try:
-            redis_client.setex(
-                cache_key,
-                3600,  # 1 hour in seconds
-                json.dumps(similar_medicines)
-            )
-        except redis.RedisError as e:
-            print(f"Failed to cache similar results for {search_term}: {str(e)}")
+
+        # Served straight from the in-process search index; cheaper than a Redis round trip
+        similar_medicines = (await get_search_ready_index()).search.search(search_term, limit)
         
         return {
             "similar_medicines": similar_medicines,
             "count": len(similar_medicines),
             "search_term": partial_name,
-            "source": "database"
+            "source": "index"
         }
         
+    except Exception as e:
+        return {"error": f"An error occurred: {str(e)}"}
+
+@app.get("/find-fuzzy/{partial_name}")
+async def find_fuzzy(partial_name: str, limit: int = 10):
+    """Typo-tolerant variant of /find-similar (Turkish-aware, trigram based)."""
+    try:
+        limit = max(0, min(limit, MAX_FUZZY_RESULTS))
+        similar_medicines = (await get_search_ready_index()).fuzzy.search(partial_name, limit)
+
+        return {
+            "similar_medicines": similar_medicines,
+            "count": len(similar_medicines),
+            "search_term": partial_name,
+            "source": "index"
+        }
+
     except Exception as e:
         return {"error": f"An error occurred: {str(e)}"}
\ No newline at end of file
@@ -4,10 +4,14 @@ import os
 import json
 import aio_pika
 import asyncio
+import time
+import sqlite3
+from collections import deque, OrderedDict
 from datetime import datetime
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, Query, Header
+from fastapi.responses import StreamingResponse
 
 load_dotenv()
 
@@ -33,29 +37,280 @@ CONNECTION_STRING = (
 # RabbitMQ connection
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
 RABBITMQ_USER = os.getenv("RABBITMQ_USER")
-RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD")
+# compose provides RABBITMQ_PASS; RABBITMQ_PASSWORD is kept for existing .env files
+RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASS", os.getenv("RABBITMQ_PASSWORD"))
 
-# We'll store incomplete prescriptions in memory for demonstration.
-# In a real system, you'd store them in a DB or keep them updated by queries.
-incomplete_prescriptions = []  # list of dicts: { "id": <int>, "timestamp": <datetime> }
+PRESCRIPTION_EVENTS_QUEUE = "prescription_events"
+
+# Consumer tuning: each consumer task gets its own channel with this prefetch,
+# and acks once per batch of up to CONSUMER_BATCH_SIZE messages
+CONSUMER_COUNT = int(os.getenv("CONSUMER_COUNT", "4"))
+CONSUMER_PREFETCH = int(os.getenv("CONSUMER_PREFETCH", "200"))
+CONSUMER_BATCH_SIZE = int(os.getenv("CONSUMER_BATCH_SIZE", "50"))
+# How long a partial batch waits for more messages before it is handled
+CONSUMER_BATCH_WAIT_SECONDS = 0.05
+QUEUE_DEPTH_POLL_SECONDS = 5
+
+# Most recent notifications kept; older ones are evicted
+NOTIFICATION_CAPACITY = int(os.getenv("NOTIFICATION_CAPACITY", "10000"))
+# Optional SQLite file so notifications survive restarts
+NOTIFICATION_DB_PATH = os.getenv("NOTIFICATION_DB_PATH")
+MAX_NOTIFICATIONS_PAGE = 1000
+
+
+class NotificationStore:
+    """
+    Bounded store of incomplete-prescription notifications.
+
+    One entry per prescription_group_id; a repeat event replaces the entry
+    and moves it to the end with a new cursor. Entries are kept in cursor
+    order, so a poll only walks the entries newer than its `since` cursor.
+    When `db_path` is given, changes are written through to SQLite and
+    reloaded on start. Not thread-safe: the consumers update it on the event
+    loop, so handlers that read it must be async.
+    """
+
+    def __init__(self, capacity: int, db_path: str = None):
+        self.capacity = capacity
+        self.entries = OrderedDict()  # group id -> notification, oldest cursor first
+        self.last_cursor = 0
+        self.db = None
+        if db_path:
+            self._open(db_path)
+
+    def _open(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(db_path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS notifications (
+                prescription_group_id INTEGER PRIMARY KEY,
+                cursor INTEGER NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+        self.db.commit()
+
+        rows = self.db.execute(
+            "SELECT data FROM notifications ORDER BY cursor DESC LIMIT ?", (self.capacity,)
+        ).fetchall()
+        for (data,) in reversed(rows):
+            notification = json.loads(data)
+            self.entries[notification["prescription_group_id"]] = notification
+            self.last_cursor = notification["cursor"]
+
+    def upsert_many(self, notifications):
+        """Add or replace notifications, each getting the next cursor; returns the stored ones."""
+        changed = {}
+        for notification in notifications:
+            self.last_cursor += 1
+            notification = {**notification, "cursor": self.last_cursor}
+            prescription_group_id = notification["prescription_group_id"]
+            self.entries.pop(prescription_group_id, None)
+            self.entries[prescription_group_id] = notification
+            changed[prescription_group_id] = notification
+
+        evicted = []
+        while len(self.entries) > self.capacity:
+            prescription_group_id, _ = self.entries.popitem(last=False)
+            changed.pop(prescription_group_id, None)
+            evicted.append((prescription_group_id,))
+
+        if self.db is not None and (changed or evicted):
+            with self.db:
+                self.db.executemany("""
+                    INSERT INTO notifications (prescription_group_id, cursor, data)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(prescription_group_id)
+                    DO UPDATE SET cursor = excluded.cursor, data = excluded.data
+                """, [
+                    (prescription_group_id, notification["cursor"], json.dumps(notification))
+                    for prescription_group_id, notification in changed.items()
+                ])
+                self.db.executemany(
+                    "DELETE FROM notifications WHERE prescription_group_id = ?", evicted
+                )
+
+        return sorted(changed.values(), key=lambda notification: notification["cursor"])
+
+    def since(self, cursor: int, limit: int):
+        """Up to `limit` notifications with a cursor after `cursor`, oldest first."""
+        newer = []
+        for notification in reversed(self.entries.values()):
+            if notification["cursor"] <= cursor:
+                break
+            newer.append(notification)
+        newer.reverse()
+        return newer[:limit]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+
+
+notification_store = NotificationStore(NOTIFICATION_CAPACITY, NOTIFICATION_DB_PATH)
+
+
+# Notifications buffered per stream client before it counts as too slow
+STREAM_QUEUE_SIZE = 256
+# Comment lines keep idle connections open through proxies
+STREAM_KEEPALIVE_SECONDS = 15
+
+
+class StreamSubscriber:
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class NotificationBroadcaster:
+    """
+    Fans stored notifications out to connected stream clients.
+
+    Publishing never waits on a client. A client whose queue fills up is
+    dropped once it has drained what it has; it reconnects with its last
+    event id and catches up from the store.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+
+    def subscribe(self) -> StreamSubscriber:
+        subscriber = StreamSubscriber()
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: StreamSubscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, notifications):
+        if not notifications:
+            return
+        for subscriber in list(self.subscribers):
+            for notification in notifications:
+                try:
+                    subscriber.queue.put_nowait(notification)
+                except asyncio.QueueFull:
+                    subscriber.overflowed = True
+                    self.subscribers.discard(subscriber)
+                    break
+
+
+notification_broadcaster = NotificationBroadcaster()
+
+class ThroughputMeter:
+    """Messages per second over a sliding window of one-second buckets."""
+
+    def __init__(self, window_seconds: int = 10):
+        self.window_seconds = window_seconds
+        self.buckets = deque()  # (second, count), oldest first
+
+    def record(self, count: int):
+        second = int(time.monotonic())
+        if self.buckets and self.buckets[-1][0] == second:
+            self.buckets[-1] = (second, self.buckets[-1][1] + count)
+        else:
+            self.buckets.append((second, count))
+        self._expire(second)
+
+    def _expire(self, now: int):
+        while self.buckets and self.buckets[0][0] <= now - self.window_seconds:
+            self.buckets.popleft()
+
+    def rate(self) -> float:
+        self._expire(int(time.monotonic()))
+        return sum(count for _, count in self.buckets) / self.window_seconds
 
-async def process_message(message: aio_pika.IncomingMessage):
-    async with message.process():
-        try:
-            event = json.loads(message.body.decode())
-            event_type = event.get("type")
-            payload = event.get("payload", {})
-            print(f"[NotificationService] Received event: {event_type}, payload: {payload}")
 
-            if event_type == "PrescriptionStatusUpdated" and payload.get("status") == "INCOMPLETE":
-                incomplete_prescriptions.append({
-                    "prescription_group_id": payload["prescription_group_id"],
-                    "timestamp": datetime.utcnow().isoformat(),  # Convert to string for JSON serialization
-                })
+throughput = ThroughputMeter()
+consumer_stats = {
+    "processed": 0,
+    "failed": 0,
+    "batches": 0,
+    # Messages ready in the queue at the last poll, i.e. how far behind we are
+    "queue_depth": None,
+}
 
+
+def handle_event(event: dict):
+    """The notification an event produces, or None if it is not of interest."""
+    event_type = event.get("type")
+    payload = event.get("payload", {})
+
+    # prescription_service reports incomplete submissions as UnfilledPrescription
+    if event_type == "UnfilledPrescription" or (
+        event_type == "PrescriptionStatusUpdated" and payload.get("status") == "INCOMPLETE"
+    ):
+        notification = {
+            "prescription_group_id": payload["prescription_group_id"],
+            "timestamp": datetime.utcnow().isoformat(),  # Convert to string for JSON serialization
+        }
+        if "unfilled_medicines" in payload:
+            notification["unfilled_medicines"] = payload["unfilled_medicines"]
+        return notification
+    return None
+
+
+def handle_messages(bodies):
+    """Decode and apply a batch of raw message bodies; returns the failure count."""
+    failed = 0
+    notifications = []
+    for body in bodies:
+        try:
+            notification = handle_event(json.loads(body))
+            if notification is not None:
+                notifications.append(notification)
         except Exception as e:
+            failed += 1
             print(f"Error processing message: {e}")
 
+    # One store write (and one SQLite transaction) per batch
+    notification_broadcaster.publish(notification_store.upsert_many(notifications))
+    return failed
+
+
+async def consume_batches(inbox: asyncio.Queue):
+    """Handle messages from one channel in batches and ack each batch at once."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await inbox.get()]
+        deadline = loop.time() + CONSUMER_BATCH_WAIT_SECONDS
+        while len(batch) < CONSUMER_BATCH_SIZE:
+            if not inbox.empty():
+                batch.append(inbox.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(inbox.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        failed = handle_messages([message.body for message in batch])
+
+        # Only this task consumes from the channel, so every earlier delivery
+        # on it is in this batch and one multiple-ack covers them all.
+        # Messages that failed to decode are acked too, as before.
+        await batch[-1].ack(multiple=True)
+
+        consumer_stats["processed"] += len(batch) - failed
+        consumer_stats["failed"] += failed
+        consumer_stats["batches"] += 1
+        throughput.record(len(batch))
+
+
+async def poll_queue_depth(channel):
+    while True:
+        queue = await channel.declare_queue(PRESCRIPTION_EVENTS_QUEUE, passive=True)
+        consumer_stats["queue_depth"] = queue.declaration_result.message_count
+        await asyncio.sleep(QUEUE_DEPTH_POLL_SECONDS)
+
+
 async def consume_prescription_events():
     """Continuously consume events from 'prescription_events' queue."""
     while True:
@@ -64,24 +319,20 @@ async def consume_prescription_events():
             connection = await aio_pika.connect_robust(
                 f"amqp://{RABBITMQ_USER}:{RABBITMQ_PASSWORD}@{RABBITMQ_HOST}:5672/"
             )
-            
-            # Create channel
-            channel = await connection.channel()
-            
-            # Declare queue
-            queue = await channel.declare_queue(
-                "prescription_events",
-                durable=True
-            )
 
-            print("[NotificationService] Connected to RabbitMQ, waiting for messages...")
-            
-            # Start consuming messages
-            await queue.consume(process_message)
-            
-            # Keep connection alive
             try:
-                await asyncio.Future()  # run forever
+                async with asyncio.TaskGroup() as group:
+                    for _ in range(CONSUMER_COUNT):
+                        channel = await connection.channel()
+                        await channel.set_qos(prefetch_count=CONSUMER_PREFETCH)
+                        queue = await channel.declare_queue(PRESCRIPTION_EVENTS_QUEUE, durable=True)
+
+                        inbox = asyncio.Queue()
+                        await queue.consume(inbox.put)
+                        group.create_task(consume_batches(inbox))
+
+                    group.create_task(poll_queue_depth(await connection.channel()))
+                    print(f"[NotificationService] Connected to RabbitMQ, {CONSUMER_COUNT} consumers waiting for messages...")
             finally:
                 await connection.close()
 
@@ -90,18 +341,120 @@ async def consume_prescription_events():
             print("[NotificationService] Retrying in 5 seconds...")
             await asyncio.sleep(5)
 
+consumer_task = None
+
 @app.on_event("startup")
 async def startup_event():
+    global consumer_task
     # Start the consumer in the background
-    asyncio.create_task(consume_prescription_events())
+    consumer_task = asyncio.create_task(consume_prescription_events())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if consumer_task is not None:
+        consumer_task.cancel()
+    notification_store.close()
 
 @app.get("/notifications")
-def get_notifications():
+async def get_notifications(
+    since: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_NOTIFICATIONS_PAGE)
+):
+    """
+    Incomplete prescriptions newer than the `since` cursor, oldest first.
+    Pass the returned `next_cursor` as `since` on the next poll.
+    """
+    # A cursor ahead of the store means the store was reset; start over
+    if since > notification_store.last_cursor:
+        since = 0
+    page = notification_store.since(since, limit)
+    return {
+        "incomplete_prescriptions": page,
+        "count": len(page),
+        "next_cursor": page[-1]["cursor"] if page else since,
+        "total": len(notification_store)
+    }
+
+def format_notification_event(notification: dict) -> str:
+    return f"id: {notification['cursor']}\nevent: notification\ndata: {json.dumps(notification)}\n\n"
+
+
+@app.get("/notifications/stream")
+async def stream_notifications(
+    since: int = Query(None, ge=0),
+    last_event_id: str = Header(None, alias="Last-Event-ID")
+):
+    """
+    Server-sent events stream of incomplete prescriptions.
+
+    Each event's id is the notification cursor. Reconnecting clients send
+    Last-Event-ID (browsers do this automatically) or `since`, and first
+    receive everything after it that is still in the store.
+    """
+    cursor = since or 0
+    if last_event_id is not None and last_event_id.isdigit():
+        cursor = int(last_event_id)
+    if cursor > notification_store.last_cursor:
+        cursor = 0
+
+    # Subscribe before reading the backlog so nothing published in between is missed
+    subscriber = notification_broadcaster.subscribe()
+
+    async def events():
+        nonlocal cursor
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                backlog = notification_store.since(cursor, MAX_NOTIFICATIONS_PAGE)
+                if not backlog:
+                    break
+                for notification in backlog:
+                    yield format_notification_event(notification)
+                cursor = backlog[-1]["cursor"]
+
+            while not (subscriber.overflowed and subscriber.queue.empty()):
+                try:
+                    notification = await asyncio.wait_for(
+                        subscriber.queue.get(), STREAM_KEEPALIVE_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                # Already sent as part of the backlog
+                if notification["cursor"] <= cursor:
+                    continue
+                cursor = notification["cursor"]
+                yield format_notification_event(notification)
+        finally:
+            notification_broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Stop nginx from buffering the stream
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+@app.get("/consumer-stats")
+async def get_consumer_stats():
     return {
-        "incomplete_prescriptions": incomplete_prescriptions,
-        "count": len(incomplete_prescriptions)
+        **consumer_stats,
+        "messages_per_second": throughput.rate(),
+        "consumers": CONSUMER_COUNT,
+        "prefetch": CONSUMER_PREFETCH,
+        "batch_size": CONSUMER_BATCH_SIZE,
+        "stream_clients": len(notification_broadcaster.subscribers)
     }
 
 @app.get("/")
 def health_check():
     return {"status": "Notification Service running"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=8000)
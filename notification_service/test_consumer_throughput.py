@@ -0,0 +1,129 @@
+# notification_service/test_consumer_throughput.py
+#
+# Drives the batch consumer with in-memory messages instead of RabbitMQ.
+# Run from this directory with: python -m unittest test_consumer_throughput
+
+import asyncio
+import json
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main
+
+
+class FakeMessage:
+    """Stands in for aio_pika.IncomingMessage and records its acks."""
+
+    ACK_LATENCY_SECONDS = 0.0002  # simulated broker round trip
+
+    def __init__(self, body: bytes, acks: list):
+        self.body = body
+        self.acks = acks
+
+    async def ack(self, multiple: bool = False):
+        self.acks.append((self, multiple))
+        await asyncio.sleep(self.ACK_LATENCY_SECONDS)
+
+
+def event_body(prescription_group_id: int, status: str = "INCOMPLETE") -> bytes:
+    return json.dumps({
+        "type": "PrescriptionStatusUpdated",
+        "payload": {"status": status, "prescription_group_id": prescription_group_id},
+    }).encode()
+
+
+class ConsumerThroughputTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        main.notification_store = main.NotificationStore(main.NOTIFICATION_CAPACITY)
+        main.throughput = main.ThroughputMeter()
+        main.consumer_stats.update(processed=0, failed=0, batches=0, queue_depth=None)
+        self.acks = []
+
+    async def consume(self, inboxes, expected: int, timeout: float = 30):
+        """Run one consume_batches task per inbox until `expected` messages are handled."""
+        tasks = [asyncio.create_task(main.consume_batches(inbox)) for inbox in inboxes]
+        try:
+            deadline = time.monotonic() + timeout
+            while main.consumer_stats["processed"] + main.consumer_stats["failed"] < expected:
+                self.assertLess(time.monotonic(), deadline, "consumers stalled")
+                await asyncio.sleep(0.01)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def test_handle_messages_counts_undecodable_bodies(self):
+        bodies = [event_body(1), b"not json", event_body(2, status="COMPLETE"), event_body(3)]
+
+        failed = main.handle_messages(bodies)
+
+        self.assertEqual(failed, 1)
+        self.assertEqual(
+            [notification["prescription_group_id"] for notification in main.notification_store.since(0, 10)],
+            [1, 3],
+        )
+
+    async def test_one_multiple_ack_per_batch(self):
+        inbox = asyncio.Queue()
+        messages = [FakeMessage(event_body(i), self.acks) for i in range(main.CONSUMER_BATCH_SIZE * 3)]
+        for message in messages:
+            inbox.put_nowait(message)
+
+        await self.consume([inbox], len(messages))
+
+        self.assertEqual(main.consumer_stats["batches"], 3)
+        self.assertEqual(len(self.acks), 3)
+        # Each ack is the last message of its batch and covers the earlier ones
+        self.assertTrue(all(multiple for _, multiple in self.acks))
+        self.assertEqual(
+            [message for message, _ in self.acks],
+            messages[main.CONSUMER_BATCH_SIZE - 1::main.CONSUMER_BATCH_SIZE],
+        )
+        self.assertEqual(len(main.notification_store), len(messages))
+
+    async def test_partial_batch_is_acked_after_the_wait(self):
+        inbox = asyncio.Queue()
+        messages = [FakeMessage(event_body(i), self.acks) for i in range(3)]
+        for message in messages:
+            inbox.put_nowait(message)
+
+        await self.consume([inbox], len(messages))
+
+        self.assertEqual(self.acks, [(messages[-1], True)])
+
+    async def test_failed_messages_are_still_acked(self):
+        inbox = asyncio.Queue()
+        messages = [FakeMessage(event_body(1), self.acks), FakeMessage(b"{", self.acks)]
+        for message in messages:
+            inbox.put_nowait(message)
+
+        await self.consume([inbox], len(messages))
+
+        self.assertEqual(main.consumer_stats["processed"], 1)
+        self.assertEqual(main.consumer_stats["failed"], 1)
+        self.assertEqual(self.acks, [(messages[-1], True)])
+
+    async def test_throughput(self):
+        total = main.CONSUMER_BATCH_SIZE * main.CONSUMER_COUNT * 100
+        inboxes = [asyncio.Queue() for _ in range(main.CONSUMER_COUNT)]
+        for i in range(total):
+            # Repeated group ids exercise the replace path of the store
+            inboxes[i % len(inboxes)].put_nowait(FakeMessage(event_body(i % 1000), self.acks))
+
+        started = time.perf_counter()
+        await self.consume(inboxes, total)
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(main.consumer_stats["processed"], total)
+        self.assertEqual(len(self.acks), total // main.CONSUMER_BATCH_SIZE)
+        self.assertGreater(main.throughput.rate(), 0)
+        print(f"\n{total} messages in {elapsed:.2f}s ({total / elapsed:.0f} msg/s), {len(self.acks)} acks")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,20 +1,27 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 import pyodbc
-import random
 from dotenv import load_dotenv
 import os
-import pika
+import aio_pika
 import json
-import requests
+import httpx
+import redis
+from redis import asyncio as aioredis
+from collections import OrderedDict
+import asyncio
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI()
-
 # Database connection configuration
 CONNECTION_STRING = (
     "Driver={ODBC Driver 18 for SQL Server};"
@@ -29,87 +36,882 @@ CONNECTION_STRING = (
 
 MEDS_SVC_HOST = os.getenv("MEDS_SVC_HOST", "http://localhost:8000")
 
-def create_table():
+# Size of the SQL connection pool; the DB thread pool gets the same size so a
+# worker never waits for a connection
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+# Idle connections older than this are checked with SELECT 1 before reuse
+DB_HEALTH_CHECK_SECONDS = 30
+
+
+class ConnectionPool:
+    """
+    Bounded pool of pyodbc connections.
+
+    At most `size` connections exist at once. Idle connections are reused
+    last-in first-out and pinged before reuse once they have been idle for
+    DB_HEALTH_CHECK_SECONDS; a connection whose user raised is closed
+    instead of being returned, since it may be mid-transaction or broken.
+    """
+
+    def __init__(self, connection_string: str, size: int):
+        self.connection_string = connection_string
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def _checkout(self):
+        while True:
+            try:
+                conn, last_used = self.idle.get_nowait()
+            except queue.Empty:
+                return pyodbc.connect(self.connection_string)
+
+            if time.monotonic() - last_used < DB_HEALTH_CHECK_SECONDS:
+                return conn
+            try:
+                conn.cursor().execute("SELECT 1").fetchall()
+                return conn
+            except pyodbc.Error:
+                self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        self.slots.acquire()
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+            # End any implicit transaction so the next user starts clean
+            conn.rollback()
+            self.idle.put((conn, time.monotonic()))
+        except Exception:
+            if conn is not None:
+                self._close(conn)
+            raise
+        finally:
+            self.slots.release()
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(conn)
+
+
+db_pool = ConnectionPool(CONNECTION_STRING, DB_POOL_SIZE)
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+
+async def run_db(fn, *args):
+    """Run a blocking DB function on the dedicated DB thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(db_executor, fn, *args)
+
+
+# Ordered schema migrations, each applied once and recorded in schema_migrations.
+# Statements stay idempotent so databases created before versioning existed
+# (table already there, possibly populated) migrate cleanly.
+SCHEMA_MIGRATIONS = [
+    (1, """
+        IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'prescriptions')
+        CREATE TABLE prescriptions (
+            id BIGINT PRIMARY KEY,
+            medicine_name VARCHAR(255),
+            quantity INT,
+            prescription_group_id BIGINT
+        )
+    """),
+    # Covering index so lookups by group id are a seek with no key lookups.
+    # Built online where the edition supports it (Enterprise, Azure SQL) so
+    # a populated table stays writable during the build.
+    (2, """
+        IF NOT EXISTS (
+            SELECT * FROM sys.indexes
+            WHERE name = 'IX_prescriptions_group_id' AND object_id = OBJECT_ID('prescriptions')
+        )
+        BEGIN
+            IF CAST(SERVERPROPERTY('EngineEdition') AS INT) IN (3, 5, 8)
+                CREATE NONCLUSTERED INDEX IX_prescriptions_group_id
+                ON prescriptions (prescription_group_id)
+                INCLUDE (medicine_name, quantity)
+                WITH (ONLINE = ON)
+            ELSE
+                CREATE NONCLUSTERED INDEX IX_prescriptions_group_id
+                ON prescriptions (prescription_group_id)
+                INCLUDE (medicine_name, quantity)
+        END
+    """),
+    # Transactional outbox: events are written with the rows they describe
+    # and relayed to RabbitMQ by relay_outbox
+    (3, """
+        IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'prescription_outbox')
+        BEGIN
+            CREATE TABLE prescription_outbox (
+                id BIGINT IDENTITY(1, 1) PRIMARY KEY,
+                event_type VARCHAR(100) NOT NULL,
+                body NVARCHAR(MAX) NOT NULL,
+                created_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+                locked_until DATETIME2 NULL,
+                sent_at DATETIME2 NULL
+            );
+            CREATE NONCLUSTERED INDEX IX_prescription_outbox_unsent
+            ON prescription_outbox (id)
+            INCLUDE (locked_until)
+            WHERE sent_at IS NULL;
+        END
+    """),
+]
+
+SCHEMA_LOCK_TIMEOUT_MS = 10 * 60 * 1000
+
+
+def migrate_schema():
     try:
-        with pyodbc.connect(CONNECTION_STRING) as conn:
+        with db_pool.connection() as conn:
             with conn.cursor() as cursor:
-                # Create prescriptions table if it doesn't exist
                 cursor.execute("""
-                    IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'prescriptions')
-                    CREATE TABLE prescriptions (
-                        id BIGINT PRIMARY KEY,
-                        medicine_name VARCHAR(255),
-                        quantity INT,
-                        prescription_group_id BIGINT
+                    IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'schema_migrations')
+                    CREATE TABLE schema_migrations (
+                        version INT PRIMARY KEY,
+                        applied_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
                     )
                 """)
                 conn.commit()
+
+                # Replicas start together; the app lock lets one of them migrate
+                # while the others wait and then find nothing left to apply
+                cursor.execute("""
+                    SET NOCOUNT ON;
+                    DECLARE @result INT;
+                    EXEC @result = sp_getapplock
+                        @Resource = 'prescriptions_schema',
+                        @LockMode = 'Exclusive',
+                        @LockOwner = 'Session',
+                        @LockTimeout = ?;
+                    SELECT @result;
+                """, (SCHEMA_LOCK_TIMEOUT_MS,))
+                if cursor.fetchone()[0] < 0:
+                    raise RuntimeError("Timed out waiting for the schema migration lock")
+
+                try:
+                    cursor.execute("SELECT version FROM schema_migrations")
+                    applied = {row[0] for row in cursor.fetchall()}
+
+                    for version, statement in SCHEMA_MIGRATIONS:
+                        if version in applied:
+                            continue
+                        cursor.execute(statement)
+                        cursor.execute("INSERT INTO schema_migrations (version) VALUES (?)", (version,))
+                        conn.commit()
+                        print(f"Applied schema migration {version}")
+                finally:
+                    conn.rollback()
+                    cursor.execute("EXEC sp_releaseapplock @Resource = 'prescriptions_schema', @LockOwner = 'Session'")
+                    conn.commit()
     except Exception as e:
-        print(f"Error creating table: {e}")
+        print(f"Error migrating schema: {e}")
         raise HTTPException(status_code=500, detail="Database initialization failed")
 
-# Generate a random 10-digit ID
+# Snowflake-style ids: milliseconds since ID_EPOCH_MS, then worker id, then a
+# per-millisecond sequence. The layout is kept to 53 bits so ids survive
+# JSON number parsing in the frontends and still fit BIGINT.
+ID_EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+ID_TIMESTAMP_BITS = 40  # ~34 years from the epoch
+ID_WORKER_BITS = 5
+ID_SEQUENCE_BITS = 8
+MAX_WORKER_ID = (1 << ID_WORKER_BITS) - 1
+ID_SEQUENCE_MASK = (1 << ID_SEQUENCE_BITS) - 1
+
+
+def default_worker_id() -> int:
+    """
+    WORKER_ID from the environment. Every replica must be given its own id;
+    two replicas sharing one would issue colliding prescription ids.
+    """
+    worker_id = os.getenv("WORKER_ID")
+    if worker_id is None:
+        raise RuntimeError(f"WORKER_ID must be set to a unique value between 0 and {MAX_WORKER_ID}")
+    return int(worker_id)
+
+
+class SnowflakeIdGenerator:
+    """Thread-safe, per-replica monotonic id generator."""
+
+    def __init__(self, worker_id: int):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"Worker id must be between 0 and {MAX_WORKER_ID}")
+        self.worker_id = worker_id
+        self.lock = threading.Lock()
+        self.last_ms = -1
+        self.sequence = 0
+
+    @staticmethod
+    def _now_ms() -> int:
+        return time.time_ns() // 1_000_000 - ID_EPOCH_MS
+
+    def next_id(self) -> int:
+        with self.lock:
+            now = self._now_ms()
+            # If the wall clock steps back, keep issuing from the last tick
+            # rather than reusing ids
+            if now < self.last_ms:
+                now = self.last_ms
+
+            if now == self.last_ms:
+                self.sequence = (self.sequence + 1) & ID_SEQUENCE_MASK
+                if self.sequence == 0:
+                    # Sequence exhausted for this millisecond; wait for the next
+                    while now <= self.last_ms:
+                        time.sleep(0.0001)
+                        now = self._now_ms()
+            else:
+                self.sequence = 0
+
+            self.last_ms = now
+            return (
+                (now << (ID_WORKER_BITS + ID_SEQUENCE_BITS))
+                | (self.worker_id << ID_SEQUENCE_BITS)
+                | self.sequence
+            )
+
+
+id_generator = SnowflakeIdGenerator(default_worker_id())
+
+
 def generate_prescription_id():
-    return random.randint(1000000000, 9999999999)
+    return id_generator.next_id()
 
 class Prescription(BaseModel):
     data: List[Tuple[str, int]]
 
-@app.on_event("startup")
-async def startup_event():
-    create_table()
+class PrescriptionBatch(BaseModel):
+    prescriptions: List[Prescription]
+
+class PrescriptionSubmitBatch(BaseModel):
+    prescription_group_ids: List[int]
+
+MAX_BATCH_PRESCRIPTIONS = 1000
+
+# RabbitMQ connection
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
+RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
+RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "guest")
+
+PUBLISH_CHANNELS = int(os.getenv("PUBLISH_CHANNELS", "4"))
+PUBLISH_BATCH_SIZE = 100
+# Events buffered while the broker is slow or down; beyond this they are dropped
+PUBLISH_QUEUE_SIZE = 10000
+
+
+class EventPublisher:
+    """
+    Long-lived RabbitMQ publisher for 'prescription_events'.
+
+    Callers only enqueue; a pool of confirm-mode channels drains the queue in
+    batches, so each batch costs one wait for broker confirms instead of a
+    connection per event. Fire-and-forget events that are not confirmed go
+    back on the queue; publish_confirmed callers get the outcome instead and
+    own the retry.
+    """
+
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+        self.task = None
+        # Set while the broker connection is up; follows the robust
+        # connection's close and reconnect callbacks
+        self.connected = asyncio.Event()
+
+    def start(self):
+        self.task = asyncio.create_task(self._serve())
+
+    def publish(self, event_type: str, payload: dict):
+        body = json.dumps({"type": event_type, "payload": payload}).encode()
+        try:
+            self.queue.put_nowait((body, None))
+        except asyncio.QueueFull:
+            print(f"[WARNING] Event queue full, dropping event {event_type}")
+
+    async def publish_confirmed(self, bodies: List[bytes], timeout: float) -> List[bool]:
+        """Publish message bodies and report which were confirmed within `timeout`."""
+        loop = asyncio.get_running_loop()
+        futures = []
+        for body in bodies:
+            future = loop.create_future()
+            try:
+                self.queue.put_nowait((body, future))
+            except asyncio.QueueFull:
+                future.set_result(False)
+            futures.append(future)
+
+        await asyncio.wait(futures, timeout=timeout)
+        confirmed = [future.done() and not future.cancelled() and future.result() for future in futures]
+        # Anything still queued is abandoned so the drain skips it
+        for future in futures:
+            future.cancel()
+        return confirmed
+
+    async def _serve(self):
+        while True:
+            try:
+                connection = await aio_pika.connect_robust(
+                    f"amqp://{RABBITMQ_USER}:{RABBITMQ_PASS}@{RABBITMQ_HOST}:5672/"
+                )
+                connection.close_callbacks.add(self._on_disconnect)
+                connection.reconnect_callbacks.add(self._on_reconnect)
+                try:
+                    channels = []
+                    for _ in range(PUBLISH_CHANNELS):
+                        channels.append(await connection.channel(publisher_confirms=True))
+                    await channels[0].declare_queue("prescription_events", durable=True)
+
+                    print("[PrescriptionService] Connected to RabbitMQ")
+                    self.connected.set()
+                    # Drains requeue failed publishes instead of raising, and
+                    # the robust connection restores their channels after a
+                    # broker outage, so they run until shutdown
+                    async with asyncio.TaskGroup() as group:
+                        for channel in channels:
+                            group.create_task(self._drain(channel))
+                finally:
+                    self.connected.clear()
+                    await connection.close()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[PrescriptionService] RabbitMQ connection error: {e}")
+                print("[PrescriptionService] Retrying in 5 seconds...")
+                await asyncio.sleep(5)
+
+    def _on_disconnect(self, connection, exc=None):
+        # exc is None when we close the connection ourselves
+        if exc is not None:
+            print(f"[PrescriptionService] Lost RabbitMQ connection: {exc}")
+        self.connected.clear()
+
+    def _on_reconnect(self, connection):
+        print("[PrescriptionService] Reconnected to RabbitMQ")
+        self.connected.set()
+
+    async def _drain(self, channel):
+        while True:
+            taken = [await self.queue.get()]
+            while len(taken) < PUBLISH_BATCH_SIZE and not self.queue.empty():
+                taken.append(self.queue.get_nowait())
+            batch = [(body, future) for body, future in taken if future is None or not future.done()]
+
+            try:
+                # Publishes are pipelined; each awaits its own confirm
+                results = await asyncio.gather(*(
+                    channel.default_exchange.publish(
+                        aio_pika.Message(body, delivery_mode=aio_pika.DeliveryMode.PERSISTENT),
+                        routing_key="prescription_events"
+                    )
+                    for body, _ in batch
+                ), return_exceptions=True)
+            except asyncio.CancelledError:
+                self._settle(batch, [asyncio.CancelledError()] * len(batch))
+                raise
+            finally:
+                for _ in taken:
+                    self.queue.task_done()
+
+            if self._settle(batch, results):
+                # The robust connection restores channels on its own; back off
+                # and retry rather than tearing down batches in flight elsewhere
+                await asyncio.sleep(1)
+
+    def _settle(self, batch, results) -> int:
+        """Resolve confirmed items and requeue or fail the rest; returns the failure count."""
+        failed = 0
+        for (body, future), result in zip(batch, results):
+            confirmed = not isinstance(result, BaseException)
+            if not confirmed:
+                failed += 1
+            if future is not None:
+                if not future.done():
+                    future.set_result(confirmed)
+            elif not confirmed:
+                try:
+                    self.queue.put_nowait((body, None))
+                except asyncio.QueueFull:
+                    print("[WARNING] Event queue full, dropping unconfirmed event")
+        if failed:
+            print(f"[WARNING] {failed} events were not confirmed")
+        return failed
+
+    async def stop(self, timeout: float = 5):
+        # Give queued events a chance to go out before shutting down
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"[WARNING] Shutting down with {self.queue.qsize()} unpublished events")
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+
+event_publisher = EventPublisher()
 
 
 def publish_event(event_type: str, payload: dict):
-    """Publish a JSON event to the 'prescription_events' queue."""
-    try:
-        credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials)
-        )
-        channel = connection.channel()
-        channel.queue_declare(queue='prescription_events', durable=True)
+    """Queue a JSON event for the 'prescription_events' queue."""
+    event_publisher.publish(event_type, payload)
 
-        event_data = {
-            "type": event_type,
-            "payload": payload
-        }
-        message = json.dumps(event_data)
-        channel.basic_publish(
-            exchange='',
-            routing_key='prescription_events',
-            body=message,
-            properties=pika.BasicProperties(
-                delivery_mode=2  # make message persistent
+
+OUTBOX_BATCH_SIZE = 500
+# Claimed rows not marked sent within this window are picked up again
+OUTBOX_LEASE_SECONDS = 30
+OUTBOX_POLL_SECONDS = 1
+OUTBOX_RETENTION_HOURS = 24
+OUTBOX_PURGE_SECONDS = 3600
+
+# Set after an outbox write so the relay picks it up without waiting for the poll
+outbox_pending = asyncio.Event()
+
+
+def outbox_row(event_type: str, payload: dict):
+    return (event_type, json.dumps({"type": event_type, "payload": payload}))
+
+
+def write_outbox(cursor, rows):
+    """Add (event_type, body) rows to the outbox on the caller's transaction."""
+    cursor.fast_executemany = True
+    cursor.setinputsizes([
+        (pyodbc.SQL_VARCHAR, 100, 0),
+        (pyodbc.SQL_WLONGVARCHAR, 0, 0),
+    ])
+    cursor.executemany("""
+        INSERT INTO prescription_outbox (event_type, body)
+        VALUES (?, ?)
+    """, rows)
+
+
+def claim_outbox_batch():
+    """
+    Lease the oldest unsent outbox rows.
+
+    READPAST lets relays on other replicas claim different rows instead of
+    blocking on ours.
+    """
+    with db_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                WITH batch AS (
+                    SELECT TOP (?) id, body, locked_until
+                    FROM prescription_outbox WITH (UPDLOCK, READPAST, ROWLOCK)
+                    WHERE sent_at IS NULL
+                      AND (locked_until IS NULL OR locked_until < SYSUTCDATETIME())
+                    ORDER BY id
+                )
+                UPDATE batch
+                SET locked_until = DATEADD(second, ?, SYSUTCDATETIME())
+                OUTPUT inserted.id, inserted.body
+            """, (OUTBOX_BATCH_SIZE, OUTBOX_LEASE_SECONDS))
+            rows = cursor.fetchall()
+            conn.commit()
+            return sorted(rows, key=lambda row: row[0])
+
+
+def mark_outbox_sent(outbox_ids: List[int]):
+    with db_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE prescription_outbox
+                SET sent_at = SYSUTCDATETIME(), locked_until = NULL
+                WHERE id IN (SELECT CAST(value AS BIGINT) FROM OPENJSON(?))
+            """, (json.dumps(outbox_ids),))
+            conn.commit()
+
+
+def purge_outbox():
+    with db_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                DELETE FROM prescription_outbox
+                WHERE sent_at < DATEADD(hour, ?, SYSUTCDATETIME())
+            """, (-OUTBOX_RETENTION_HOURS,))
+            conn.commit()
+
+
+async def relay_outbox():
+    """Drain the outbox to RabbitMQ in batches and mark confirmed rows sent."""
+    last_purge = time.monotonic()
+    while True:
+        try:
+            # Rows claimed while the broker is down would time out and leave
+            # abandoned entries filling the shared publish queue
+            await event_publisher.connected.wait()
+            rows = await run_db(claim_outbox_batch)
+            if rows:
+                confirmed = await event_publisher.publish_confirmed(
+                    [row[1].encode() for row in rows], timeout=OUTBOX_LEASE_SECONDS / 2
+                )
+                sent_ids = [row[0] for row, ok in zip(rows, confirmed) if ok]
+                if sent_ids:
+                    await run_db(mark_outbox_sent, sent_ids)
+                if len(sent_ids) < len(rows):
+                    # Broker trouble; the unsent rows come back once their lease expires
+                    await asyncio.sleep(OUTBOX_POLL_SECONDS)
+                    continue
+
+            if time.monotonic() - last_purge > OUTBOX_PURGE_SECONDS:
+                await run_db(purge_outbox)
+                last_purge = time.monotonic()
+
+            if len(rows) < OUTBOX_BATCH_SIZE:
+                outbox_pending.clear()
+                try:
+                    await asyncio.wait_for(outbox_pending.wait(), OUTBOX_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error relaying outbox: {e}")
+            await asyncio.sleep(5)
+
+
+# Medicine lookups fail fast rather than pinning request handlers
+MEDS_TIMEOUT = httpx.Timeout(2.0, connect=1.0, pool=1.0)
+MEDS_MAX_CONNECTIONS = int(os.getenv("MEDS_MAX_CONNECTIONS", "20"))
+MEDS_BREAKER_FAILURES = 5
+MEDS_BREAKER_RESET_SECONDS = 10
+# Catalog updates are rare, so short-lived existence answers are safe to reuse
+MEDICINE_CACHE_TTL = 30
+MEDICINE_CACHE_SIZE = 10000
+
+
+class MedicineServiceUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls for
+    `reset_seconds`, then lets one trial call through per window until a
+    call succeeds.
+    """
+
+    def __init__(self, threshold: int, reset_seconds: float):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_seconds:
+            return False
+        # Restart the window so only this call is the trial
+        self.opened_at = now
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class MedicineClient:
+    """
+    Keep-alive client for medicine_service's /find-medicines.
+
+    Concurrency is bounded by the connection pool, every call has a timeout,
+    and a circuit breaker turns a struggling medicine_service into an
+    immediate MedicineServiceUnavailable. Existence answers are cached
+    locally for MEDICINE_CACHE_TTL seconds.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.breaker = CircuitBreaker(MEDS_BREAKER_FAILURES, MEDS_BREAKER_RESET_SECONDS)
+        self.cache = {}  # name -> (exists, expires_at), oldest first
+
+    def start(self):
+        self.client = httpx.AsyncClient(
+            base_url=MEDS_SVC_HOST,
+            timeout=MEDS_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=MEDS_MAX_CONNECTIONS,
+                max_keepalive_connections=MEDS_MAX_CONNECTIONS
             )
         )
-        connection.close()
-    except Exception as e:
-        print(f"[WARNING] Failed to publish event {event_type}: {e}")
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+
+    def _cache_set(self, name: str, exists: bool, expires_at: float):
+        self.cache.pop(name, None)
+        self.cache[name] = (exists, expires_at)
+        if len(self.cache) > MEDICINE_CACHE_SIZE:
+            del self.cache[next(iter(self.cache))]
+
+    async def lookup(self, names: List[str]) -> Tuple[List[str], List[str]]:
+        """Split `names` into (existing, non_existing), preserving order."""
+        now = time.monotonic()
+        known = {}
+        for name in set(names):
+            cached = self.cache.get(name)
+            if cached is not None and cached[1] > now:
+                known[name] = cached[0]
+
+        missing = [name for name in dict.fromkeys(names) if name not in known]
+        if missing:
+            if not self.breaker.allow():
+                raise MedicineServiceUnavailable("Medicine service circuit is open")
+            try:
+                response = await self.client.post("/find-medicines", json={"names": missing})
+                response.raise_for_status()
+                data = response.json()
+                # medicine_service reports failures in the body
+                if "error" in data:
+                    raise MedicineServiceUnavailable(data["error"])
+                existing = set(data["existing_medicines"])
+            except (httpx.HTTPError, ValueError, KeyError, MedicineServiceUnavailable) as e:
+                self.breaker.record_failure()
+                raise MedicineServiceUnavailable(str(e)) from e
+            self.breaker.record_success()
+
+            expires_at = time.monotonic() + MEDICINE_CACHE_TTL
+            for name in missing:
+                known[name] = name in existing
+                self._cache_set(name, known[name], expires_at)
+
+        existing_names = [name for name in names if known[name]]
+        non_existing_names = [name for name in names if not known[name]]
+        return existing_names, non_existing_names
+
+
+medicine_client = MedicineClient()
+
+
+# Prescriptions are immutable once committed, so cached copies never go stale
+PRESCRIPTION_CACHE_SIZE = int(os.getenv("PRESCRIPTION_CACHE_SIZE", "10000"))
+
+# Optional shared tier, enabled when REDIS_HOST is set
+redis_client = None
+
+
+def prescription_cache_key(prescription_group_id: int) -> str:
+    return f"prescription:{prescription_group_id}"
+
+
+class PrescriptionCache:
+    """Bounded in-process LRU of prescription lines keyed by group id."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, prescription_group_id: int):
+        lines = self.entries.get(prescription_group_id)
+        if lines is not None:
+            self.entries.move_to_end(prescription_group_id)
+        return lines
+
+    def set(self, prescription_group_id: int, lines: List[Tuple[str, int]]):
+        self.entries[prescription_group_id] = lines
+        self.entries.move_to_end(prescription_group_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+prescription_cache = PrescriptionCache(PRESCRIPTION_CACHE_SIZE)
+
+
+def cache_prescriptions(prescriptions: Dict[int, List[Tuple[str, int]]]):
+    for prescription_group_id, lines in prescriptions.items():
+        prescription_cache.set(prescription_group_id, lines)
+
+
+async def store_prescriptions_in_redis(prescriptions: Dict[int, List[Tuple[str, int]]]):
+    if redis_client is None or not prescriptions:
+        return
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for prescription_group_id, lines in prescriptions.items():
+                pipe.setex(
+                    prescription_cache_key(prescription_group_id),
+                    86400,  # 1 day in seconds
+                    json.dumps(lines)
+                )
+            await pipe.execute()
+    except redis.RedisError as e:
+        print(f"Failed to cache prescriptions: {str(e)}")
+
+
+async def get_prescriptions_lines(prescription_group_ids: List[int]) -> Dict[int, List[Tuple[str, int]]]:
+    """
+    Read-through lookup of prescription lines: in-process LRU, then Redis,
+    then one SQL query for whatever is left. Unknown ids are left out.
+    """
+    prescriptions = {}
+    missing = []
+    for prescription_group_id in prescription_group_ids:
+        lines = prescription_cache.get(prescription_group_id)
+        if lines is not None:
+            prescriptions[prescription_group_id] = lines
+        else:
+            missing.append(prescription_group_id)
+
+    if missing and redis_client is not None:
+        try:
+            cached_values = await redis_client.mget([prescription_cache_key(i) for i in missing])
+            from_redis = {
+                prescription_group_id: [tuple(line) for line in json.loads(cached)]
+                for prescription_group_id, cached in zip(missing, cached_values)
+                if cached is not None
+            }
+            cache_prescriptions(from_redis)
+            prescriptions.update(from_redis)
+            missing = [i for i in missing if i not in from_redis]
+        except redis.RedisError as e:
+            print(f"Failed to read cached prescriptions: {str(e)}")
+
+    if missing:
+        from_db = await run_db(fetch_prescriptions_rows, missing)
+        cache_prescriptions(from_db)
+        await store_prescriptions_in_redis(from_db)
+        prescriptions.update(from_db)
+
+    return prescriptions
+
+
+async def get_prescription_lines(prescription_group_id: int):
+    return (await get_prescriptions_lines([prescription_group_id])).get(prescription_group_id)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global redis_client
+
+    await run_db(migrate_schema)
+    event_publisher.start()
+    medicine_client.start()
+    if os.getenv("REDIS_HOST"):
+        redis_client = aioredis.Redis(
+            host=os.getenv("REDIS_HOST"),
+            port=int(os.getenv("REDIS_PORT") or 6379),
+            username=os.getenv("REDIS_USERNAME"),
+            password=os.getenv("REDIS_PASSWORD"),
+            decode_responses=True
+        )
+    relay_task = asyncio.create_task(relay_outbox())
+    yield
+    relay_task.cancel()
+    try:
+        await relay_task
+    except asyncio.CancelledError:
+        pass
+    await event_publisher.stop()
+    await medicine_client.close()
+    if redis_client is not None:
+        await redis_client.aclose()
+    db_executor.shutdown(wait=True)
+    db_pool.close()
+
+app = FastAPI(lifespan=lifespan)
+
+
+def insert_prescriptions(batch: List[List[Tuple[str, int]]]) -> List[int]:
+    """
+    Insert every line of every prescription in one transaction.
+
+    Rows go out through fast_executemany as a single parameter array instead
+    of one round trip per line, and a PrescriptionCreated outbox row per
+    prescription commits with them. Returns the group id of each prescription
+    in input order.
+    """
+    group_ids = []
+    rows = []
+    events = []
+    for data in batch:
+        prescription_group_id = generate_prescription_id()
+        group_ids.append(prescription_group_id)
+        for medicine_name, quantity in data:
+            rows.append((generate_prescription_id(), medicine_name, quantity, prescription_group_id))
+        events.append(outbox_row("PrescriptionCreated", {
+            "prescription_group_id": prescription_group_id,
+            "data": data
+        }))
+
+    with db_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            if rows:
+                cursor.fast_executemany = True
+                # Fixed sizes keep pyodbc from re-deriving buffers per row
+                cursor.setinputsizes([
+                    (pyodbc.SQL_BIGINT, 0, 0),
+                    (pyodbc.SQL_VARCHAR, 255, 0),
+                    (pyodbc.SQL_INTEGER, 0, 0),
+                    (pyodbc.SQL_BIGINT, 0, 0),
+                ])
+                cursor.executemany("""
+                    INSERT INTO prescriptions (id, medicine_name, quantity, prescription_group_id)
+                    VALUES (?, ?, ?, ?)
+                """, rows)
+            if events:
+                write_outbox(cursor, events)
+            conn.commit()
+    return group_ids
+
+
+def insert_prescription(data: List[Tuple[str, int]]) -> int:
+    return insert_prescriptions([data])[0]
+
+
+def fetch_prescriptions_rows(prescription_group_ids: List[int]):
+    """Medicine lines of many prescriptions in one query, as {group id: [(name, quantity)]}."""
+    with db_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT prescription_group_id, medicine_name, quantity
+                FROM prescriptions
+                WHERE prescription_group_id IN (
+                    SELECT CAST(value AS BIGINT) FROM OPENJSON(?)
+                )
+            """, (json.dumps(prescription_group_ids),))
+            prescriptions = {}
+            for prescription_group_id, medicine_name, quantity in cursor.fetchall():
+                prescriptions.setdefault(prescription_group_id, []).append((medicine_name, quantity))
+            return prescriptions
 
 
 @app.post("/register-prescription")
-async def register_prescription(prescription: Prescription):
+async def register_prescription(prescription: Prescription, background_tasks: BackgroundTasks):
     # Print the incoming request data
     print("Received prescription data:", prescription)
     
     try:
-        prescription_group_id = generate_prescription_id()
-        with pyodbc.connect(CONNECTION_STRING) as conn:
-            with conn.cursor() as cursor:
-                for medicine_name, quantity in prescription.data:
-                    medicine_id = generate_prescription_id()
-                    cursor.execute("""
-                        INSERT INTO prescriptions (id, medicine_name, quantity, prescription_group_id)
-                        VALUES (?, ?, ?, ?)
-                    """, (medicine_id, medicine_name, quantity, prescription_group_id))
-                conn.commit()
+        # The PrescriptionCreated event is committed with the rows and relayed
+        # from the outbox
+        prescription_group_id = await run_db(insert_prescription, prescription.data)
+        outbox_pending.set()
 
-        # Publish event after success:
-        publish_event("PrescriptionCreated", {
-            "prescription_group_id": prescription_group_id,
-            "data": prescription.data
-        })
+        # Populate the read cache so the pharmacy's first read is a hit
+        written = {prescription_group_id: [tuple(line) for line in prescription.data]}
+        cache_prescriptions(written)
+        background_tasks.add_task(store_prescriptions_in_redis, written)
 
         return {
             "status": "success",
@@ -120,35 +922,78 @@ async def register_prescription(prescription: Prescription):
         print(f"Error inserting prescription: {e}")
         raise HTTPException(status_code=500, detail="Failed to save prescription")
 
+@app.post("/register-prescriptions")
+async def register_prescriptions(batch: PrescriptionBatch, background_tasks: BackgroundTasks):
+    """Register many prescriptions in a single transaction."""
+    if len(batch.prescriptions) > MAX_BATCH_PRESCRIPTIONS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {MAX_BATCH_PRESCRIPTIONS} prescriptions can be registered per request"
+        )
+
+    try:
+        prescription_group_ids = await run_db(
+            insert_prescriptions, [prescription.data for prescription in batch.prescriptions]
+        )
+        outbox_pending.set()
+
+        written = {
+            prescription_group_id: [tuple(line) for line in prescription.data]
+            for prescription_group_id, prescription in zip(prescription_group_ids, batch.prescriptions)
+        }
+        cache_prescriptions(written)
+        background_tasks.add_task(store_prescriptions_in_redis, written)
+
+        return {
+            "status": "success",
+            "ids": prescription_group_ids
+        }
+
+    except Exception as e:
+        print(f"Error inserting prescription batch: {e}")
+        raise HTTPException(status_code=500, detail="Failed to save prescriptions")
+
 @app.get("/prescription/{prescription_group_id}")
 async def get_prescription(prescription_group_id: int):
     try:
-        with pyodbc.connect(CONNECTION_STRING) as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT medicine_name, quantity 
-                    FROM prescriptions 
-                    WHERE prescription_group_id = ?
-                """, (prescription_group_id,))
-                
-                results = cursor.fetchall()
-                
-                if not results:
-                    raise HTTPException(status_code=404, detail="Prescription not found")
-                
-                prescription_data = [{"medicine_name": row[0], "quantity": row[1]} for row in results]
-                
-                return {
-                    "status": "success",
-                    "prescription_group_id": prescription_group_id,
-                    "medications": prescription_data
-                }
+        results = await get_prescription_lines(prescription_group_id)
+        
+        if not results:
+            raise HTTPException(status_code=404, detail="Prescription not found")
+        
+        prescription_data = [{"medicine_name": row[0], "quantity": row[1]} for row in results]
+        
+        return {
+            "status": "success",
+            "prescription_group_id": prescription_group_id,
+            "medications": prescription_data
+        }
     
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error retrieving prescription: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve prescription")
 
 
+def submission_result(prescription_group_id: int, filled_medicines: List[str], unfilled_medicines: List[str]):
+    status = "COMPLETED" if not unfilled_medicines else "INCOMPLETE"
+
+    # Publish event about unfilled medicines
+    if unfilled_medicines:
+        publish_event("UnfilledPrescription", {
+            "prescription_group_id": prescription_group_id,
+            "unfilled_medicines": unfilled_medicines
+        })
+
+    return {
+        "status": status,
+        "prescription_group_id": prescription_group_id,
+        "filled_medicines": filled_medicines,
+        "unfilled_medicines": unfilled_medicines
+    }
+
+
 @app.post("/prescription/submit/{prescription_group_id}")
 async def submit_prescription_status(prescription_group_id: int):
     """
@@ -156,50 +1001,76 @@ async def submit_prescription_status(prescription_group_id: int):
     Returns lists of filled (existing) and unfilled (non-existing) medicines.
     """
     try:
-        with pyodbc.connect(CONNECTION_STRING) as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT medicine_name
-                    FROM prescriptions
-                    WHERE prescription_group_id = ?
-                """, (prescription_group_id,))
-                
-                results = cursor.fetchall()
-                if not results:
-                    raise HTTPException(status_code=404, detail="Prescription not found")
-
-                all_medicines = [row[0] for row in results]
-                
-                lookup_response = requests.post(
-                    f"{MEDS_SVC_HOST}/find-medicines",
-                    json={"names": all_medicines}
-                )
-                
-                if lookup_response.status_code != 200:
-                    raise HTTPException(status_code=500, detail="Failed to verify medicines")
-                
-                lookup_data = lookup_response.json()
-                
-                # Use the lookup results to determine filled/unfilled
-                filled_medicines = lookup_data["existing_medicines"]
-                unfilled_medicines = lookup_data["non_existing_medicines"]
-                
-                status = "COMPLETED" if not unfilled_medicines else "INCOMPLETE"
-
-                # Publish event about unfilled medicines
-                if unfilled_medicines:
-                    publish_event("UnfilledPrescription", {
-                        "prescription_group_id": prescription_group_id,
-                        "unfilled_medicines": unfilled_medicines
-                    })
-
-                return {
-                    "status": status,
-                    "prescription_group_id": prescription_group_id,
-                    "filled_medicines": filled_medicines,
-                    "unfilled_medicines": unfilled_medicines
-                }
+        # The SQL connection is back in the pool before the medicine lookup starts
+        results = await get_prescription_lines(prescription_group_id)
+        if not results:
+            raise HTTPException(status_code=404, detail="Prescription not found")
+
+        all_medicines = [row[0] for row in results]
+        
+        # Use the lookup results to determine filled/unfilled
+        try:
+            filled_medicines, unfilled_medicines = await medicine_client.lookup(all_medicines)
+        except MedicineServiceUnavailable as e:
+            print(f"Medicine lookup failed: {e}")
+            raise HTTPException(status_code=503, detail="Medicine service unavailable")
+        
+        return submission_result(prescription_group_id, filled_medicines, unfilled_medicines)
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in submit_prescription_status: {e}")
-        raise HTTPException(status_code=500, detail="Failed to submit prescription status")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to submit prescription status")
+
+
+@app.post("/prescriptions/submit")
+async def submit_prescriptions_status(batch: PrescriptionSubmitBatch):
+    """
+    Submit many prescriptions with one SQL query and one medicine lookup.
+
+    Medicine names are deduplicated across the whole batch before the lookup.
+    Results come back in request order; unknown ids get status NOT_FOUND.
+    """
+    if len(batch.prescription_group_ids) > MAX_BATCH_PRESCRIPTIONS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {MAX_BATCH_PRESCRIPTIONS} prescriptions can be submitted per request"
+        )
+
+    try:
+        prescription_group_ids = list(dict.fromkeys(batch.prescription_group_ids))
+        prescriptions = await get_prescriptions_lines(prescription_group_ids)
+
+        all_medicines = list(dict.fromkeys(
+            medicine_name
+            for lines in prescriptions.values()
+            for medicine_name, _ in lines
+        ))
+        try:
+            existing_medicines, _ = await medicine_client.lookup(all_medicines)
+        except MedicineServiceUnavailable as e:
+            print(f"Medicine lookup failed: {e}")
+            raise HTTPException(status_code=503, detail="Medicine service unavailable")
+        existing_medicines = set(existing_medicines)
+
+        results = []
+        for prescription_group_id in prescription_group_ids:
+            lines = prescriptions.get(prescription_group_id)
+            if lines is None:
+                results.append({"status": "NOT_FOUND", "prescription_group_id": prescription_group_id})
+                continue
+            names = [medicine_name for medicine_name, _ in lines]
+            results.append(submission_result(
+                prescription_group_id,
+                [name for name in names if name in existing_medicines],
+                [name for name in names if name not in existing_medicines]
+            ))
+
+        return {"results": results}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in submit_prescriptions_status: {e}")
+        raise HTTPException(status_code=500, detail="Failed to submit prescriptions")